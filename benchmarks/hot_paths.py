@@ -0,0 +1,250 @@
+"""Times the ETL, vectorization, parsing and menu hot paths at several data
+sizes on synthetic Recipe1M-shaped data, the saved ella/ corpus and an
+in-memory Mongo (mongomock), and writes the results as JSON.
+
+    python benchmarks/hot_paths.py [--sizes 1000,10000] [--repeat 3]
+        [--output results.json] [--compare baseline.json --tolerance 0.25]
+
+Every benchmark reports the median of --repeat runs. With --compare, runs
+more than --tolerance slower than the baseline are listed and the script
+exits non-zero.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import click
+import mongomock
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'localvore'))
+
+import ETL_pipeline  # noqa: E402
+import clustering  # noqa: E402
+from parsing import ella_tags  # noqa: E402
+from recipe_clusters import update_clusters  # noqa: E402
+from recipe_index import RecipeIndex  # noqa: E402
+from scraper import RecipeScraper  # noqa: E402
+
+UNITS = ['cup', 'tbsp', 'tsp', 'oz', 'lb', 'clove', 'pinch', 'can']
+STATE = 'tennessee'
+
+
+def vocabulary(size=2000, seed=0) -> List[str]:
+    """Ingredient names made of one or two pseudo words"""
+    rng = np.random.RandomState(seed)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    words = [''.join(rng.choice(letters, rng.randint(3, 9)))
+             for _ in range(size)]
+    return [word if rng.rand() < 0.7 else f'{word} {words[i - 1]}'
+            for i, word in enumerate(words)]
+
+
+def layer1_recipes(n: int, seed=0) -> List[Dict]:
+    """Recipes shaped like Recipe1M's layer1.json"""
+    rng = np.random.RandomState(seed)
+    names = vocabulary(seed=seed)
+    recipes = []
+    for i in range(n):
+        ingredients = rng.choice(names, rng.randint(3, 15))
+        recipes.append({
+            'id': f'{i:010x}', 'title': f'Recipe {i}',
+            'url': f'http://example.com/recipe/{i}',
+            'partition': 'train',
+            'ingredients': [{'text': f'{rng.randint(1, 4)} '
+                                     f'{rng.choice(UNITS)} {name}, chopped'}
+                            for name in ingredients],
+            'instructions': [{'text': 'Mix everything.'}]})
+    return recipes
+
+
+def det_ingrs(n: int, seed=0):
+    """A load_predictions frame shaped like Recipe1M's det_ingrs.json"""
+    import pandas as pd
+    rng = np.random.RandomState(seed)
+    names = vocabulary(seed=seed)
+    raw, valid = [], []
+    for _ in range(n):
+        count = rng.randint(3, 15)
+        raw.append([{'text': name} for name in rng.choice(names, count)])
+        valid.append((rng.rand(count) < 0.8).tolist())
+    return pd.DataFrame({'_id': [f'{i:010x}' for i in range(n)],
+                         'raw_ingrs': raw, 'valid': valid})
+
+
+def recipe_vectors(n: int, dim=300, seed=0) -> RecipeIndex:
+    """An in-memory index of n vectors drawn around 50 topics"""
+    rng = np.random.RandomState(seed)
+    topics = rng.rand(50, dim).astype(np.float32)
+    index = RecipeIndex()
+    index.vectors = (topics[rng.randint(0, 50, n)]
+                     + rng.normal(scale=0.1, size=(n, dim))
+                     ).astype(np.float32)
+    index.dim = dim
+    index.ids = np.array([str(i) for i in range(n)], dtype=object)
+    index.titles = [f'Recipe {i}' for i in range(n)]
+    return index
+
+
+def timed(run: Callable[[], object], setup: Callable[[], tuple] = None,
+          repeat=3) -> List[float]:
+    """Seconds of every run; setup builds fresh arguments outside the
+    timing"""
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_insert_recipes(size, repeat, workdir):
+    layer1 = workdir / f'layer1_{size}.json'
+    layer1.write_text(json.dumps(layer1_recipes(size)))
+    return timed(lambda col: ETL_pipeline.insert_recipes(layer1, col),
+                 lambda: (mongomock.MongoClient().RECIPES.recipe1M,), repeat)
+
+
+def bench_filter_predictions(size, repeat, workdir):
+    df = det_ingrs(size)
+    return timed(lambda: ETL_pipeline.filter_predictions(df), repeat=repeat)
+
+
+def bench_vectorization(size, repeat, workdir):
+    import spacy
+    nlp = spacy.blank('en')
+    recipes = ETL_pipeline.filter_predictions(det_ingrs(size))
+    docs = recipes.to_dict('records')
+
+    def setup():
+        col = mongomock.MongoClient().RECIPES.recipe1M
+        col.insert_many([dict(doc) for doc in docs])
+        return col, tempfile.mkdtemp(dir=workdir)
+    return timed(lambda col, table: ETL_pipeline.ingredient_vectorization(
+        col, nlp=nlp, table_path=Path(table)), setup, repeat)
+
+
+def bench_make_post(size, repeat, workdir):
+    corpus = [path.read_bytes() for path in sorted((ROOT / 'ella')
+                                                   .glob('*.html'))]
+    pages = [corpus[i % len(corpus)] for i in range(size)]
+    scraper = RecipeScraper(ella_tags, 'bench', save=False)
+    return timed(lambda: [scraper.make_post(page) for page in pages],
+                 repeat=repeat)
+
+
+def _register(size):
+    """Puts a synthetic collection, its seasonal coverage and clusters into
+    the clustering caches"""
+    name = f'bench{size}'
+    index = recipe_vectors(size)
+    coverage = np.random.RandomState(1).randint(0, 4, size).astype(np.int32)
+    clustering.matrices.set(name, index, size=1)
+    clustering.masks.set((name, size, STATE, clustering.get_date()),
+                         coverage)
+    return name, index
+
+
+def bench_fit_clusters(size, repeat, workdir):
+    index = recipe_vectors(size)
+    return timed(lambda: update_clusters(index), repeat=repeat)
+
+
+def bench_create_samples(size, repeat, workdir):
+    name, _ = _register(size)
+    return timed(lambda: clustering.create_samples(name, STATE),
+                 repeat=repeat)
+
+
+def bench_clustering(size, repeat, workdir):
+    name, index = _register(size)
+    clustering.matrices.set(('clusters', name, size), update_clusters(index))
+    clustering.clustering(STATE, [name])
+    return timed(lambda: clustering.clustering(STATE, [name]), repeat=repeat)
+
+
+BENCHMARKS = {
+    'insert_recipes': bench_insert_recipes,
+    'filter_predictions': bench_filter_predictions,
+    'vectorization': bench_vectorization,
+    'make_post': bench_make_post,
+    'fit_clusters': bench_fit_clusters,
+    'create_samples': bench_create_samples,
+    'clustering': bench_clustering,
+}
+
+
+def metadata() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(ROOT),
+                                stdout=subprocess.PIPE, check=True
+                                ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(),
+            'date': datetime.utcnow().isoformat()}
+
+
+def regressions(results: List[Dict], baseline: List[Dict],
+                tolerance: float) -> List[str]:
+    before = {(result['name'], result['size']): result['seconds']
+              for result in baseline}
+    slower = []
+    for result in results:
+        key = (result['name'], result['size'])
+        if key in before and result['seconds'] > before[key] * (1 + tolerance):
+            slower.append(f'{key[0]} at {key[1]}: {before[key]:.4f}s -> '
+                          f'{result["seconds"]:.4f}s')
+    return slower
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000',
+              help='Comma separated data sizes')
+@click.option('--repeat', default=3, help='Runs per benchmark and size')
+@click.option('--only', multiple=True, type=click.Choice(list(BENCHMARKS)),
+              help='Benchmark to run, may be repeated. Defaults to all')
+@click.option('--output', default=None, help='JSON file, defaults to stdout')
+@click.option('--compare', default=None,
+              help='JSON results of an earlier run to compare against')
+@click.option('--tolerance', default=0.25,
+              help='Allowed slowdown against --compare, as a fraction')
+def main(sizes, repeat, only, output, compare, tolerance):
+    from loguru import logger
+    logger.remove()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in only or BENCHMARKS:
+            for size in [int(size) for size in sizes.split(',')]:
+                times = BENCHMARKS[name](size, repeat, Path(workdir))
+                seconds = statistics.median(times)
+                results.append({'name': name, 'size': size,
+                                'seconds': seconds, 'runs': times,
+                                'per_second': size / seconds})
+                print(f'{name:>18} {size:>8}: {seconds:9.4f}s '
+                      f'({size / seconds:12.0f}/s)', file=sys.stderr)
+    report = json.dumps({'meta': metadata(), 'results': results}, indent=2)
+    if output:
+        Path(output).write_text(report)
+    else:
+        print(report)
+    if compare:
+        baseline = json.loads(Path(compare).read_text())['results']
+        slower = regressions(results, baseline, tolerance)
+        if slower:
+            sys.exit('Regressions:\n' + '\n'.join(slower))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Parses the saved ella/ corpus with every RecipeExtractor backend, inline
+and through a process pool, and reports pages/sec for each.
+
+    python benchmarks/parse_corpus.py [--corpus ella] [--workers 4]
+"""
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'localvore'))
+
+from parsing import BACKENDS, RecipeExtractor, ella_tags  # noqa: E402
+
+
+def bench_backend(pages, backend, workers=None):
+    """Returns pages/sec of one backend, parsing inline when workers is
+    None and through a process pool otherwise"""
+    extractor = RecipeExtractor(ella_tags, backend)
+    start = time.perf_counter()
+    if workers is None:
+        posts = [extractor(page) for page in pages]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            posts = list(pool.map(extractor, pages, chunksize=16))
+    elapsed = time.perf_counter() - start
+    assert sum(post is not None for post in posts) > 0
+    return len(pages) / elapsed
+
+
+@click.command()
+@click.option('--corpus', default=str(ROOT / 'ella'),
+              help='Folder of saved recipe html')
+@click.option('--workers', default=4, type=int,
+              help='Process pool size for the pooled runs')
+def main(corpus, workers):
+    pages = [path.read_bytes() for path in sorted(Path(corpus).glob('*.html'))]
+    print(f'{len(pages)} pages from {corpus}')
+    for backend in BACKENDS:
+        inline = bench_backend(pages, backend)
+        pooled = bench_backend(pages, backend, workers)
+        print(f'{backend:>5}: {inline:8.1f} pages/sec inline, '
+              f'{pooled:8.1f} pages/sec with {workers} processes')
+
+
+if __name__ == '__main__':
+    main()
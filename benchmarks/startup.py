@@ -0,0 +1,75 @@
+"""Measures the cold start of an API worker: import time of app.py and the
+latency of its first request, each in a fresh interpreter, and which heavy
+modules were loaded along the way. Exits non-zero when importing app pulls
+in a heavy module or the median import time exceeds --max-import, so it
+can gate cold-start regressions.
+
+    python benchmarks/startup.py [--runs 5] [--path /api/menu/tennessee]
+
+The default path serves stored menus, so it needs a MongoDB with menus
+materialized by menus.py; pass --path / to time the bare app instead.
+"""
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+
+ROOT = Path(__file__).resolve().parents[1]
+# Nothing on the serving path should need these at import time
+HEAVY = ('sklearn', 'spacy', 'pandas', 'requests_html', 'pyppeteer',
+         'scraper', 'clustering')
+
+CHILD = '''
+import json, sys, time
+sys.path.insert(0, {localvore!r})
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+on_import = [name for name in {heavy!r} if name in sys.modules]
+response = app.app.test_client().get({path!r})
+print(json.dumps({{
+    'import': imported - start,
+    'first_request': time.perf_counter() - imported,
+    'status': response.status_code,
+    'heavy_on_import': on_import,
+    'heavy_on_request': [name for name in {heavy!r} if name in sys.modules],
+}}))
+'''
+
+
+def cold_start(path: str) -> dict:
+    """Imports app and serves path once in a new interpreter"""
+    code = CHILD.format(localvore=str(ROOT / 'localvore'), heavy=HEAVY,
+                        path=path)
+    out = subprocess.run([sys.executable, '-c', code], check=True,
+                         stdout=subprocess.PIPE, cwd=str(ROOT)).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+@click.command()
+@click.option('--runs', default=5, help='Fresh interpreters to start')
+@click.option('--path', default='/api/menu/tennessee',
+              help='Path of the first request')
+@click.option('--max-import', default=1.0,
+              help='Fail when the median import takes longer, in seconds')
+def main(runs, path, max_import):
+    results = [cold_start(path) for _ in range(runs)]
+    imports = statistics.median(result['import'] for result in results)
+    requests = statistics.median(result['first_request']
+                                 for result in results)
+    print(f'import app: {imports * 1000:8.1f} ms median of {runs}')
+    print(f'first GET {path}: {requests * 1000:8.1f} ms median, status '
+          f'{results[-1]["status"]}')
+    print(f'loaded by the request: {results[-1]["heavy_on_request"]}')
+    heavy = results[-1]['heavy_on_import']
+    if heavy:
+        sys.exit(f'Importing app loaded {heavy}')
+    if imports > max_import:
+        sys.exit(f'Import took {imports:.2f}s, over {max_import:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
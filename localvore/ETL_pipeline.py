@@ -1,73 +1,149 @@
 import itertools
-import pickle
+import json
+import shutil
 import sys
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
 
 import click
 import ijson
 import numpy as np
 import pandas as pd
-import spacy
-from bson.binary import Binary
 from loguru import logger
-from pymongo import MongoClient, errors
+from pymongo import MongoClient, UpdateOne, errors
 from tqdm import tqdm
 
+from ingredient_index import build_ingredient_index
+from recipe_clusters import update_clusters
+from recipe_index import INDEX_PATH, update_index
+from vector_format import decode_vector, encode_vector, is_encoded
+from vector_table import TABLE_PATH, IngredientVectorTable
+
 #Global variables for default filepaths/urls, can be altered via click
 MONGOPATH = 'mongodb://localhost:27017/'
 PATH_TO_LAYER1 = '/media/dal/Localvore Volume/layer1.json'
 PREDICTION_DATA = 'http://data.csail.mit.edu/im2recipe/det_ingrs.json'
+CACHE_DIR = Path.home() / '.cache' / 'localvore'
+DUPLICATE_KEY = 11000
+CHECKPOINTS = 'checkpoints'
 
 logger.add(sys.stderr, format="{level} {message}", level='INFO')
 
 
-def mongo_init(mongopath):
+def mongo_init(mongopath, collection='recipe1M'):
     """Instantiates MongoDB instance, creating recipe1M collection if it does
     not exist"""
     client = MongoClient(mongopath)
     database = client.RECIPES
-    col = database['recipe1M']
+    col = database[collection]
     return col
 
 
+def stream_recipes(layer1_path):
+    """Lazily yields one {_id, title, url} document per item of layer1.json.
+    Whole items are parsed by ijson, so a record missing a key simply omits
+    it instead of leaking fields into its neighbour."""
+    with open(layer1_path, 'rb') as f:
+        for item in ijson.items(f, 'item'):
+            entry = {'_id': item['id']}
+            for key in ('title', 'url'):
+                if key in item:
+                    entry[key] = item[key]
+            yield entry
+
+
+def _batched(iterable, size):
+    """Groups an iterable into lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert_batch(batch, collection):
+    """Unordered insert_many that skips over duplicate keys, so reruns over
+    a partially loaded collection keep going. Returns number inserted."""
+    try:
+        return len(collection.insert_many(batch, ordered=False).inserted_ids)
+    except errors.BulkWriteError as e:
+        fatal = [err for err in e.details['writeErrors']
+                 if err['code'] != DUPLICATE_KEY]
+        if fatal:
+            raise
+        return e.details['nInserted']
+
+
 @logger.catch()
-def insert_recipes(layer1_path, collection):
+def insert_recipes(layer1_path, collection, batch_size=1000):
     """Chunks through json text of recipe dataset, writes id, name, and url
     to MongoDB. Due to large size of json (1.8gb on disk), data is instead
-    streamed using ijson, with checks for matching json keys at each point."""
-    entry = dict()
-    for prefix, _, value in tqdm(ijson.parse(open(layer1_path))):
-        if len(entry) == 3:
-            collection.insert_one(entry)
-            entry = dict()
-        if prefix == 'item.id':
-            entry['_id'] = value
-        elif prefix == 'item.title':
-            entry['title'] = value
-        elif prefix == 'item.url':
-            entry['url'] = value
-
-
-def _compression(ingrs, truths):
-    """Helper function for filter_predictions"""
-    if not any(truths):
-        return np.NaN
-    else:
-        return list(itertools.compress(ingrs, truths))
-
-
-def _textract(row):
-    """Helper function for filter_predictions"""
-    return [item['text'] for item in row]
-
-
-def load_predictions(data_url):
-    """I/O function for filter_predictions"""
-    df = pd.read_json(data_url)
-    df.rename(columns={'id': '_id',
-                       'ingredients': 'raw_ingrs',
-                       'valid': 'valid'},
-              inplace=True)
-    return df
+    streamed using ijson and written in unordered batches of batch_size."""
+    inserted, seen = 0, 0
+    start = time.perf_counter()
+    progress = tqdm(unit=' recipes')
+    for batch in _batched(stream_recipes(layer1_path), batch_size):
+        inserted += _insert_batch(batch, collection)
+        seen += len(batch)
+        progress.update(len(batch))
+    progress.close()
+    elapsed = time.perf_counter() - start
+    logger.info(f'Inserted {inserted} of {seen} recipes '
+                f'({seen / max(elapsed, 1e-9):.0f} records/sec)')
+    return inserted
+
+
+def _is_url(source):
+    return urlparse(str(source)).scheme in ('http', 'https')
+
+
+def fetch_cached(url, cache_dir=CACHE_DIR):
+    """Downloads url into cache_dir once and returns the local path. The
+    ETag and size of the download are kept in a sidecar file; on reruns a
+    HEAD request is compared against them and the cached copy is reused when
+    they match, or when the server cannot be reached."""
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / Path(urlparse(url).path).name
+    meta_path = path.with_name(path.name + '.meta')
+    meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+    if path.exists() and path.stat().st_size == meta.get('size'):
+        try:
+            with urlopen(Request(url, method='HEAD')) as r:
+                remote = {'etag': r.headers.get('ETag'),
+                          'size': int(r.headers.get('Content-Length', -1))}
+        except OSError as e:
+            logger.warning(f'Could not reach {url} ({e}), using cached copy')
+            return path
+        if remote['etag'] == meta.get('etag') and remote['size'] in (
+                -1, meta['size']):
+            logger.info(f'Using cached {path}')
+            return path
+    logger.info(f'Downloading {url} to {path}')
+    partial = path.with_name(path.name + '.part')
+    with urlopen(url) as r, open(partial, 'wb') as f:
+        shutil.copyfileobj(r, f, length=1 << 20)
+        etag = r.headers.get('ETag')
+    partial.replace(path)
+    meta_path.write_text(json.dumps({'etag': etag,
+                                     'size': path.stat().st_size}))
+    return path
+
+
+def load_predictions(data_url, chunk_size=10000, cache_dir=CACHE_DIR):
+    """I/O function for filter_predictions. Streams det_ingrs.json from a
+    local path or a (disk cached) url with ijson, yielding DataFrames of at
+    most chunk_size recipes rather than loading the whole file at once."""
+    path = fetch_cached(data_url, cache_dir) if _is_url(data_url) else data_url
+    with open(path, 'rb') as f:
+        for batch in _batched(ijson.items(f, 'item'), chunk_size):
+            yield pd.DataFrame({'_id': [item['id'] for item in batch],
+                                'raw_ingrs': [item['ingredients']
+                                              for item in batch],
+                                'valid': [item['valid'] for item in batch]})
 
 
 def filter_predictions(df):
@@ -86,62 +162,196 @@ def filter_predictions(df):
     ingredients: Array of dicts, all with "text" as key
     valid: Array of boolean values to be mapped over "ingredients"
 
-    These are mapped by a "valid" array with boolean values, then written to
-    mongo.
+    Rather than compressing row by row, every ingredient of the frame is
+    flattened into one array alongside the row it came from, masked by the
+    flattened "valid" array in a single pass, then regrouped per recipe.
+    Recipes without a single valid ingredient are dropped.
     """
-    logger.info('Starting compression operation...')
-    df['cleaned'] = df[['raw_ingrs', 'valid']].apply(lambda x:
-                                                     _compression(*x),
-                                                     axis=1)
-    df.dropna(inplace=True)
-    logger.info('Doing list comprehensions on cleaned df...')
-    df['ingredients'] = df['cleaned'].apply(_textract)
-    df.drop(['raw_ingrs', 'valid', 'cleaned'], axis=1, inplace=True)
-    logger.info('Cleaning done!')
-    return df
-
-
-def insert_ingredients(df, collection):
-    """Bulk write of filtered ingredient lists to MongoDB"""
+    if df.empty:
+        return pd.DataFrame({'_id': [], 'ingredients': []})
+    counts = np.minimum(df['raw_ingrs'].str.len().to_numpy(dtype=int),
+                        df['valid'].str.len().to_numpy(dtype=int))
+    rows = np.repeat(np.arange(len(df)), counts)
+    texts = np.array([item['text'] for ingrs, n in zip(df['raw_ingrs'], counts)
+                      for item in ingrs[:n]], dtype=object)
+    valid = np.fromiter(itertools.chain.from_iterable(
+        truths[:n] for truths, n in zip(df['valid'], counts)),
+        dtype=bool, count=counts.sum())
+    kept_rows, kept_texts = rows[valid], texts[valid]
+    recipe_rows, starts = np.unique(kept_rows, return_index=True)
+    groups = np.split(kept_texts, starts[1:]) if len(starts) else []
+    return pd.DataFrame({'_id': df['_id'].to_numpy()[recipe_rows],
+                         'ingredients': [group.tolist() for group in groups]})
+
+
+def _chunk_frame(df, chunk_size):
+    """Yields consecutive row slices of df with at most chunk_size rows"""
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size]
+
+
+def insert_ingredients(df, collection, chunk_size=1000):
+    """Bulk write of filtered ingredient lists to MongoDB, one unordered
+    bulk_write of UpdateOne operations per chunk_size recipes"""
     logger.info('Starting bulk write to Mongo')
-    for row in tqdm(df.itertuples(index=False)):
-        collection.update_one({'_id': row[0]},
-                              {'$set': {'ingredients': row[1]}})
+    modified = 0
+    for chunk in _chunk_frame(df, chunk_size):
+        operations = [UpdateOne({'_id': _id},
+                                {'$set': {'ingredients': ingrs}})
+                      for _id, ingrs in zip(chunk['_id'],
+                                            chunk['ingredients'])]
+        if operations:
+            result = collection.bulk_write(operations, ordered=False)
+            modified += result.modified_count
+    return modified
 
 
-def ingredient_vectorization(collection):
-    """Performs word2vec on all ingredients in each recipe, pickles average
-    vector of each recipe"""
-    nlp = spacy.load('en_core_web_lg')
-    logger.info('Starting word2vec')
-    for recipe in tqdm(collection.find({}, no_cursor_timeout=True)):
+def process_predictions(frames, collection, chunk_size=1000):
+    """Filters and writes prediction frames one at a time, so only a single
+    chunk's flattened ingredient arrays are held in memory"""
+    total = 0
+    for frame in tqdm(frames, unit=' chunks'):
+        total += insert_ingredients(filter_predictions(frame), collection,
+                                    chunk_size)
+    logger.info(f'Updated ingredients for {total} recipes')
+    return total
+
+
+def _pending_recipes(collection, last_id=None, id_range=None):
+    """Recipes with ingredients but no vector yet, in _id order so progress
+    can be resumed from the last written _id. id_range limits them to
+    lower <= _id < upper, either bound may be None."""
+    query = {'ingredients': {'$exists': True}, 'vector': {'$exists': False}}
+    bounds = dict()
+    lower, upper = id_range or (None, None)
+    if lower is not None:
+        bounds['$gte'] = lower
+    if upper is not None:
+        bounds['$lt'] = upper
+    if last_id is not None:
+        bounds['$gt'] = last_id
+    if bounds:
+        query['_id'] = bounds
+    return collection.find(query, {'ingredients': 1},
+                           no_cursor_timeout=True).sort('_id', 1)
+
+
+def ingredient_vectorization(collection, batch_size=1000, n_process=1,
+                             nlp=None, table_path=TABLE_PATH, id_range=None,
+                             read_only=False):
+    """Performs word2vec on all ingredients in each recipe, stores average
+    vector of each recipe in the compact float32 format. Vectors come from
+    the ingredient vector table, so spaCy only runs for ingredients it has
+    not seen before (saved to the table once, at the end), and are written
+    back with one bulk_write keyed on _id per batch. Recipes that already
+    have a vector are skipped, and the last written _id is checkpointed so a
+    lost cursor (or a killed job) picks up where it stopped. With id_range
+    only that slice of _ids is vectorized, under its own checkpoint. With
+    read_only the table is never written, and a new ingredient raises."""
+    table = IngredientVectorTable(table_path, nlp=nlp, n_process=n_process,
+                                  read_only=read_only)
+    checkpoints = collection.database[CHECKPOINTS]
+    key = f'vectorization:{collection.name}'
+    if id_range is not None:
+        key += f':{id_range[0]}:{id_range[1]}'
+    last_id = (checkpoints.find_one({'_id': key}) or {}).get('last_id')
+    logger.info('Starting word2vec'
+                + (f' from checkpoint {last_id}' if last_id else ''))
+    while True:
+        cursor = _pending_recipes(collection, last_id, id_range)
         try:
-            ingredients = " ".join([item.lower() for item in recipe['ingredients']])
-        except (KeyError, errors.CursorNotFound) as e:
-            logger.warning(f'Caught exception {e}')
-            pass
-        tokens = nlp(ingredients)
-        vector = Binary(pickle.dumps(tokens.vector))
-        collection.update_one(recipe, {'$set': {'vector': vector}})
+            for batch in _batched(tqdm(cursor, unit=' recipes'), batch_size):
+                vectors = table.recipe_vectors([recipe['ingredients']
+                                                for recipe in batch])
+                collection.bulk_write(
+                    [UpdateOne({'_id': recipe['_id']},
+                               {'$set': {'vector': encode_vector(vector)}})
+                     for recipe, vector in zip(batch, vectors)],
+                    ordered=False)
+                last_id = batch[-1]['_id']
+                checkpoints.update_one({'_id': key},
+                                       {'$set': {'last_id': last_id}},
+                                       upsert=True)
+        except errors.CursorNotFound as e:
+            logger.warning(f'Caught exception {e}, resuming after {last_id}')
+            continue
+        finally:
+            cursor.close()
+            # New table rows are kept even if the run stops here
+            table.flush()
+        break
+    checkpoints.delete_one({'_id': key})
     logger.info('Mongo collection is up to date!')
 
 
+def migrate_vectors(collection, batch_size=1000):
+    """Rewrites pickled vectors in place in the compact float32 format with
+    one bulk_write per batch. Returns the number of bytes saved."""
+    cursor = collection.find({'vector': {'$exists': True}}, {'vector': 1},
+                             no_cursor_timeout=True)
+    converted, old_size, new_size = 0, 0, 0
+    try:
+        for batch in _batched(tqdm(cursor, unit=' vectors'), batch_size):
+            operations = list()
+            for recipe in batch:
+                if is_encoded(recipe['vector']):
+                    continue
+                vector = encode_vector(decode_vector(recipe['vector']))
+                old_size += len(recipe['vector'])
+                new_size += len(vector)
+                operations.append(UpdateOne({'_id': recipe['_id']},
+                                            {'$set': {'vector': vector}}))
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+                converted += len(operations)
+    finally:
+        cursor.close()
+    saved = old_size - new_size
+    logger.info(f'Converted {converted} vectors in {collection.name}, '
+                f'{old_size / 1e6:.1f} MB -> {new_size / 1e6:.1f} MB '
+                f'(saved {saved / 1e6:.1f} MB)')
+    return saved
+
+
 @click.command()
 @click.option('--layer1', default=False, help='Layer1 json filepath')
 @click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--collection', default='recipe1M',
+              help='Recipe collection to build or migrate')
+@click.option('--batch-size', default=1000, type=int,
+              help='Number of recipes per bulk write')
 @click.option('--prediction_url', default=False,
-              help='URL to LSTM predictions')
+              help='URL or filepath to LSTM predictions')
+@click.option('--cache-dir', default=str(CACHE_DIR),
+              help='Where downloaded prediction files are cached')
+@click.option('--migrate-vectors', 'migrate', is_flag=True,
+              help='Convert pickled vectors to the compact float32 format')
 @click.option('--vectorization', default=True,
               help='Whether to calculate recipe vectors (time intensive!)')
-def main(layer1, mongopath, prediction_url, vectorization):
-    col = mongo_init(mongopath)
+@click.option('--n-process', default=1, type=int,
+              help='Number of spaCy worker processes for vectorization')
+@click.option('--vector-table', default=str(TABLE_PATH),
+              help='Directory of the ingredient vector lookup table')
+@click.option('--index-dir', default=str(INDEX_PATH),
+              help='Directory of the recipe vector indexes')
+def main(layer1, mongopath, collection, batch_size, prediction_url,
+         cache_dir, migrate, vectorization, n_process, vector_table,
+         index_dir):
+    col = mongo_init(mongopath, collection)
+    if migrate:
+        migrate_vectors(col, batch_size)
     if layer1:
-        insert_recipes(layer1, col)
+        insert_recipes(layer1, col, batch_size)
     if prediction_url:
-        predictions = load_predictions(prediction_url)
-        insert_ingredients(filter_predictions(predictions), col)
+        predictions = load_predictions(prediction_url, batch_size, cache_dir)
+        process_predictions(predictions, col, batch_size)
     if vectorization:
-        ingredient_vectorization(col)
+        ingredient_vectorization(col, batch_size, n_process,
+                                 table_path=vector_table)
+        index = update_index(col, index_dir, batch_size)
+        build_ingredient_index(col, index)
+        if len(index):
+            update_clusters(index)
 
 if __name__ == '__main__':
     main()
@@ -1,8 +1,37 @@
-from flask import Flask, jsonify
-from clustering import clustering
-from threading import Thread
+from flask import Flask, Response, jsonify, request
+import tracing
+from jobs import ALGORITHMS, JobQueue, run_clustering
+from menus import DEFAULT_COLLECTIONS, MONGOPATH, MenuStore, serve_menu
 
 app = Flask(__name__)
+menu_store = MenuStore(MONGOPATH)
+jobs = JobQueue(MONGOPATH)
+
+
+# Requests sending this header get their stage breakdown back in a
+# Server-Timing header, when tracing is enabled
+DEBUG_HEADER = 'X-Localvore-Debug'
+
+
+@app.before_request
+def start_trace():
+    tracing.start_request()
+
+
+@app.after_request
+def end_trace(response):
+    stages = tracing.finish_request()
+    if stages is not None and DEBUG_HEADER in request.headers:
+        response.headers['Server-Timing'] = tracing.server_timing(stages)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings of this worker as Prometheus histograms. Start the
+    app with LOCALVORE_TRACING=1 to record them."""
+    return Response(tracing.render(),
+                    content_type='text/plain; version=0.0.4')
 
 
 @app.route('/')
@@ -12,7 +41,45 @@ def hello_world():
 
 @app.route('/api/menu/<string:state>', methods=['GET'])
 def get_menu(state):
-    return jsonify({'menu': clustering(state)})
+    """Serves the precomputed menus of state in rotation. Recipe
+    collections are chosen with ?collection=, defaulting to BudgetBytes."""
+    collections = request.args.getlist('collection') or DEFAULT_COLLECTIONS
+    with tracing.span('get_menu'):
+        menu = serve_menu(menu_store, state, collections)
+    return jsonify({'menu': menu})
+
+
+@app.route('/api/cluster', methods=['POST'])
+def post_cluster():
+    """Starts a clustering run and returns its job id right away. The JSON
+    body names the algorithm ('menu' or 'clusters'), the state, the recipe
+    collections and any keyword arguments of the algorithm under 'params';
+    unknown keywords are rejected before a job is started. Identical runs
+    still in progress share one job."""
+    body = request.get_json(silent=True) or dict()
+    algorithm = body.get('algorithm', 'menu')
+    if algorithm not in ALGORITHMS or 'state' not in body:
+        return jsonify({'error': f'Expected a state and an algorithm in '
+                                 f'{list(ALGORITHMS)}'}), 400
+    params = body.get('params') or dict()
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Expected params to be an object'}), 400
+    unknown = sorted(set(params) - set(ALGORITHMS[algorithm]))
+    if unknown:
+        return jsonify({'error': f'Unknown params {unknown} for {algorithm}, '
+                                 f'expected {ALGORITHMS[algorithm]}'}), 400
+    collections = body.get('collections') or list(DEFAULT_COLLECTIONS)
+    job_id = jobs.submit(run_clustering, algorithm, body['state'],
+                         collections, **params)
+    return jsonify({'id': job_id, 'status': f'/api/jobs/{job_id}'}), 202
+
+
+@app.route('/api/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': f'No job {job_id}'}), 404
+    return jsonify(job)
 
 
 def create_app(config=None):
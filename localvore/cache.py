@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Hashable
+
+
+class TTLCache:
+    """
+    Least recently used cache whose entries also expire ttl seconds after
+    they were stored. The cache is bounded by the summed size in bytes of
+    its values (their nbytes attribute, or an explicit size) rather than by
+    entry count, since a collection matrix and a seasonal mask differ in
+    size by orders of magnitude. Hit, miss and eviction counters are kept
+    so the bounds can be tuned.
+    """
+    def __init__(self, max_bytes: int, ttl: float = 3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def _live(self, key) -> bool:
+        """Whether key is present and unexpired, dropping it if expired"""
+        if key not in self._data:
+            return False
+        if self._data[key][0] < time.monotonic():
+            self._pop(key)
+            return False
+        return True
+
+    def _pop(self, key):
+        _, size, _ = self._data.pop(key)
+        self.nbytes -= size
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            if not self._live(key):
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return self._data[key][2]
+
+    def set(self, key: Hashable, value, size: int = None):
+        size = getattr(value, 'nbytes', 0) if size is None else size
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], object]):
+        """Returns the cached value for key, calling loader on a miss"""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] = None):
+        """Drops every entry, or only those whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._data
+                        if predicate is None or predicate(key)]:
+                self._pop(key)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {'entries': len(self._data), 'bytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
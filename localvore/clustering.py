@@ -1,68 +1,201 @@
-import pickle
-from random import randint
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 
-from sklearn.neighbors import NearestNeighbors
-from sklearn.cluster import DBSCAN, OPTICS
 import numpy as np
-import pandas as pd
+from pymongo import MongoClient
 
-from models import backend_query
+from cache import TTLCache
+from ingredient_index import INGREDIENTS_FILE, InvertedIndex
+from models import MONGOPATH, backend_query, seasonal_store
+from recipe_clusters import RecipeClusters, update_clusters
+from recipe_index import INDEX_PATH, RecipeIndex
+from seasonal import get_date
+from snapshot import SNAPSHOT_PATH, Snapshot
+from tracing import span
 
 
-def create_samples(collection: str, state: str) -> Dict:
-    """Creates dict of recipe names, along with their associated vectors.
-    Goal is to feed this forward into NearestNeighbors algorithm"""
-    result = dict()
-    cursor = backend_query(collection, state)
-    cursor.rewind()
-    for recipe in cursor:
-        name = recipe['title']
-        result[name] = pickle.loads(recipe['vector'])
-    assert len(result) > 0, 'No matching recipes'
-    return result
+# Collection matrices and ingredient indexes are large and rarely change;
+# seasonal coverage is a few bytes per recipe and changes twice a month with
+# get_date()
+matrices = TTLCache(max_bytes=4 * 2**30, ttl=24 * 3600)
+masks = TTLCache(max_bytes=256 * 2**20, ttl=3600)
 
 
-def clustering(state: str, collections: List[str], n_recipes=5) -> List[Dict]:
-    """Simplest clustering algorithm for recipe vectors. Requires State name, 
-    recipe collections used, and the number of recipes to be output. Valid
-    collection names are currently BB for BudgetBytes, Recipe1M, and 
+def collection_matrix(collection: str) -> RecipeIndex:
+    """Every vector of a collection as one contiguous float32 matrix with
+    parallel id and title arrays. The on-disk index is memory-mapped when
+    one has been built, then an exported snapshot, otherwise titles and
+    vectors are read once with a projection-only query."""
+    @span('load_matrix')
+    def load():
+        index = RecipeIndex(INDEX_PATH / collection)
+        if len(index) == 0 and Snapshot.exists(SNAPSHOT_PATH / collection):
+            index = Snapshot(SNAPSHOT_PATH / collection).to_index()
+        if len(index) == 0:
+            client = MongoClient(MONGOPATH)
+            index = RecipeIndex.from_collection(client.RECIPES[collection])
+        return index
+    return matrices.get_or_load(collection, load)
+
+
+def ingredient_index(collection: str) -> Optional[InvertedIndex]:
+    """The inverted ingredient index saved next to the collection's
+    RecipeIndex by the ETL, or None if it has not been built"""
+    path = INDEX_PATH / collection / INGREDIENTS_FILE
+    if not path.exists():
+        return None
+    return matrices.get_or_load(('ingredients', collection),
+                                lambda: InvertedIndex.load(path))
+
+
+def seasonal_coverage(collection: str, state: str) -> np.ndarray:
+    """Number of seasonal ingredients used by each row of a collection
+    matrix, cached per (state, period). The matrix length is part of the
+    key so a grown index never reuses counts of the wrong shape. Without an
+    inverted index this falls back to exact matching in Mongo."""
+    index = collection_matrix(collection)
+
+    @span('seasonal_coverage')
+    def load():
+        inverted = ingredient_index(collection)
+        if inverted is None:
+            with span('backend_query'):
+                cursor = backend_query(collection, state,
+                                       projection={'_id': 1})
+                mask = index.mask(recipe['_id'] for recipe in cursor)
+            return mask.astype(np.int32)
+        return inverted.coverage(seasonal_store.get(state), align_to=index.ids)
+    key = (collection, len(index), state, get_date())
+    return masks.get_or_load(key, load)
+
+
+def seasonal_mask(collection: str, state: str) -> np.ndarray:
+    """Boolean mask over a collection matrix of the recipes using seasonal
+    ingredients"""
+    return seasonal_coverage(collection, state) > 0
+
+
+@span('create_samples')
+def create_samples(collection: str, state: str) -> Tuple[List[str],
+                                                          np.ndarray]:
+    """Creates recipe names, along with their associated vectors as rows of
+    a matrix. Goal is to feed this forward into NearestNeighbors algorithm"""
+    index = collection_matrix(collection)
+    mask = seasonal_mask(collection, state)
+    assert mask.any(), 'No matching recipes'
+    names = [index.titles[row] for row in np.flatnonzero(mask)]
+    return names, index.vectors[mask]
+
+
+def cache_stats() -> Dict[str, Dict]:
+    return {'matrices': matrices.stats(), 'masks': masks.stats()}
+
+
+def collection_clusters(collection: str) -> RecipeClusters:
+    """Cluster labels of every row of a collection matrix. Saved clusters
+    are reused, labelling rows added since they were fit; a collection
+    without any is clustered once and cached."""
+    index = collection_matrix(collection)
+    return matrices.get_or_load(('clusters', collection, len(index)),
+                                span('load_clusters')(
+                                    lambda: update_clusters(index)))
+
+
+@span('seasonal_clusters')
+def seasonal_clusters(state: str, collection='BB',
+                      n_clusters=5) -> List[Dict]:
+    """The n_clusters largest clusters among the seasonal recipes of a
+    collection, each with its size and the seasonal recipe nearest its
+    centroid"""
+    index = collection_matrix(collection)
+    clusters = collection_clusters(collection)
+    rows = np.flatnonzero(seasonal_mask(collection, state))
+    assert len(rows), 'No matching recipes'
+    labels = clusters.labels[rows]
+    distances = clusters.distances(rows, index.vectors[rows])
+    # Rows sorted by cluster, then distance: the first row of every cluster
+    # is its representative
+    order = np.lexsort((distances, labels))
+    found, first, sizes = np.unique(labels[order], return_index=True,
+                                    return_counts=True)
+    largest = np.argsort(-sizes, kind='stable')[:n_clusters]
+    return [{'cluster_label': int(found[i]), 'size': int(sizes[i]),
+             'name': index.titles[rows[order[first[i]]]]} for i in largest]
+
+
+def cluster_candidates(collection: str, state: str,
+                       per_cluster=3) -> np.ndarray:
+    """Rows of the per_cluster seasonal recipes with the highest seasonal
+    coverage in every cluster of a collection, grouped by cluster. Cached
+    like the coverage it is ranked by."""
+    index = collection_matrix(collection)
+
+    @span('cluster_candidates')
+    def load():
+        coverage = seasonal_coverage(collection, state)
+        rows = np.flatnonzero(coverage)
+        labels = collection_clusters(collection).labels[rows]
+        order = np.lexsort((-coverage[rows], labels))
+        rank = np.arange(len(order)) - np.searchsorted(labels[order],
+                                                       labels[order])
+        return rows[order[rank < per_cluster]]
+    key = ('candidates', collection, len(index), state, get_date())
+    return masks.get_or_load(key, load)
+
+
+@span('mmr')
+def mmr(relevance: np.ndarray, vectors: np.ndarray, k: int,
+        weight=0.7) -> np.ndarray:
+    """Maximal marginal relevance: picks k rows one at a time, each
+    maximizing weight * relevance - (1 - weight) * its highest cosine
+    similarity to the rows already picked. Returns their positions."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    similarity = unit @ unit.T
+    closest = np.zeros(len(relevance))
+    available = np.ones(len(relevance), dtype=bool)
+    picked = []
+    for _ in range(min(k, len(relevance))):
+        score = weight * relevance - (1 - weight) * closest
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        picked.append(best)
+        available[best] = False
+        closest = np.maximum(closest, similarity[best])
+    return np.array(picked, dtype=np.int64)
+
+
+@span('clustering')
+def clustering(state: str, collections: List[str], n_recipes=5,
+               seed: int = None, weight=0.7) -> List[str]:
+    """Menu of n_recipes recipe names drawn from different clusters. Valid
+    collection names are currently BB for BudgetBytes, Recipe1M, and
     Epi for Epicurious.
-    
-    Returns a list of length n_recipes containing recipe names satisfying
-    the criteria of create_samples"""
-    nested_names, nested_X = [], []
+
+    Every cluster of the seasonal recipes offers one candidate, chosen at
+    random among its recipes with the best seasonal coverage. Candidates
+    are ranked by coverage (with a little random jitter, so menus vary
+    between calls) and picked by maximal marginal relevance, so the menu
+    spreads across clusters rather than being near-duplicates. The same
+    seed gives the same menu."""
+    rng = np.random.RandomState(seed)
+    names, relevance, blocks = [], [], []
     for collection in collections:
-        collection_dict = create_samples(collection, state)
-        key, val = collection_dict.keys(), collection_dict.values()
-        nested_names.append(list(key))
-        nested_X.append(list(val))
-
-    names, X = [], []
-    for name_sublist, x_sublist in zip(nested_names, nested_X):
-        for item in name_sublist:
-            names.append(item)
-        for item in x_sublist:
-            X.append(item)
-
-    neigh = NearestNeighbors(n_neighbors=n_recipes, n_jobs=-1)
-    neigh.fit(X)
-    indices = neigh.kneighbors([X[randint(0, len(X))]], return_distance=False)
-    return [names[index] for index in indices[0]]
-
-
-def dbscan(state, collection='BB', epsilon=0.2) -> List[Dict]:
-    names, X = [], []
-    collection_dict = create_samples(collection, state)
-    names.append(list(collection_dict.keys()))
-    X.append(list(collection_dict.values()))
-    names = names[0]
-    X = X[0]
-    print(f'Finished query. {len(names)} Items returned.')
-    neigh = OPTICS(cluster_method='dbscan', n_jobs=-1)
-    neigh.fit(X)
-    df = pd.DataFrame({'X': X, 'cluster_label': neigh.labels_, 'name': names})
-    inliers = df[df['cluster_label'] != -1]
-    print(inliers.head())
-    inliers.groupby('cluster_label').first()
-    return list(df.loc[df['name', :5]])
+        index = collection_matrix(collection)
+        rows = cluster_candidates(collection, state)
+        if not len(rows):
+            continue
+        coverage = seasonal_coverage(collection, state)[rows]
+        labels = collection_clusters(collection).labels[rows]
+        # One candidate per cluster: random among its best covered rows
+        order = np.lexsort((rng.rand(len(rows)), -coverage, labels))
+        _, first = np.unique(labels[order], return_index=True)
+        chosen = order[first]
+        names.extend(index.titles[row] for row in rows[chosen])
+        relevance.append(coverage[chosen])
+        blocks.append(index.vectors[rows[chosen]])
+    assert names, 'No matching recipes'
+    relevance = np.concatenate(relevance).astype(np.float64)
+    relevance = relevance / relevance.max() + rng.uniform(0, 0.1,
+                                                          len(relevance))
+    picked = mmr(relevance, np.vstack(blocks), n_recipes, weight)
+    return [names[i] for i in picked]
@@ -0,0 +1,219 @@
+import asyncio
+import sys
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from loguru import logger
+
+from manifest import CrawlManifest
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+logger.add(sys.stderr)
+
+
+def retry_after(value: Optional[str], default: float) -> float:
+    """Seconds to wait according to a Retry-After header, which is either a
+    number of seconds or an HTTP date. default is returned when the header
+    is missing or malformed."""
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when is None or when.tzinfo is None:
+        return default
+    return max(when.timestamp() - time.time(), 0.)
+
+
+class Crawler:
+    """
+    Concurrency-bounded async fetcher shared by a whole crawl.
+
+    - One pooled ClientSession, with at most `workers` requests in flight
+      overall and `per_host` per host.
+    - Requests to a host start at most `rate` times per second.
+    - Failed requests (connection errors, timeouts, 429 and 5xx) are retried
+      `retries` times with exponential backoff, honouring Retry-After.
+    - crawl() feeds urls through a bounded work queue to N workers, and
+      parsed items through a bounded result queue to a single writer, so a
+      slow writer throttles fetching instead of piling up pages in memory.
+    - With a CrawlManifest, fetches are conditional GETs and pages whose
+      content is unchanged since they last parsed are skipped.
+
+    Use as an async context manager:
+        async with Crawler() as crawler:
+            await crawler.crawl(urls, parse, write)
+    """
+    def __init__(self, workers=10, per_host=4, rate=5.0, retries=3,
+                 backoff=1.0, queue_size=100, timeout=30,
+                 manifest: CrawlManifest = None):
+        self.workers = workers
+        self.per_host = per_host
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.manifest = manifest
+        self.session: Optional[ClientSession] = None
+        self._hosts: Dict[str, asyncio.Semaphore] = dict()
+        self._next_start: Dict[str, float] = dict()
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0,
+                      'unchanged': 0}
+
+    async def __aenter__(self):
+        connector = TCPConnector(limit=self.workers,
+                                 limit_per_host=self.per_host)
+        self.session = ClientSession(connector=connector,
+                                     timeout=ClientTimeout(self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _throttle(self, host: str):
+        """Waits for the next request slot of host under its rate limit"""
+        now = time.monotonic()
+        start = max(now, self._next_start.get(host, now))
+        self._next_start[host] = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def request(self, url: str, headers: Dict[str, str] = None
+                      ) -> Tuple[int, Dict[str, str], bytes]:
+        """GETs url, returning (status, headers, body). Retryable failures
+        are retried with backoff; the last one is raised."""
+        host = urlparse(url).netloc
+        semaphore = self._hosts.setdefault(host,
+                                           asyncio.Semaphore(self.per_host))
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            async with semaphore:
+                await self._throttle(host)
+                self.stats['requests'] += 1
+                try:
+                    async with self.session.get(url, headers=headers) as r:
+                        body = await r.read()
+                        if r.status not in RETRY_STATUSES:
+                            return r.status, dict(r.headers), body
+                        delay = retry_after(r.headers.get('Retry-After'),
+                                            delay)
+                        error = ClientError(f'{r.status} from {url}')
+                except (ClientError, asyncio.TimeoutError) as e:
+                    error = e
+            if attempt < self.retries:
+                self.stats['retries'] += 1
+                logger.debug(f'Retrying {url} in {delay:.1f}s ({error})')
+                await asyncio.sleep(delay)
+        self.stats['failures'] += 1
+        raise error
+
+    async def fetch(self, url: str) -> Optional[bytes]:
+        """Body of url, or None when it does not exist, keeps failing or
+        is unchanged according to the manifest"""
+        headers = (self.manifest.conditional_headers(url)
+                   if self.manifest is not None else None)
+        try:
+            status, response_headers, body = await self.request(url, headers)
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f'Giving up on {url}: {e}')
+            return None
+        if status == 304:
+            self.manifest.not_modified(url)
+            self.stats['unchanged'] += 1
+            return None
+        if status >= 400:
+            logger.warning(f'Got {status} from {url}')
+            return None
+        if self.manifest is not None and not self.manifest.record(
+                url, status, response_headers, body):
+            self.stats['unchanged'] += 1
+            return None
+        return body
+
+    async def crawl(self, urls: Iterable[str], parse: Callable,
+                    write: Callable[[object], Optional[Awaitable]]):
+        """Fetches urls with N workers. parse(url, body) returns a list of
+        further urls to crawl and an item (or None) for the writer; it may
+        be a coroutine, e.g. to hand CPU-bound parsing to an executor. write
+        is called with every item from a single task and may also be a
+        coroutine."""
+        work = asyncio.Queue(maxsize=self.queue_size)
+        results = asyncio.Queue(maxsize=self.queue_size)
+        # Discovered urls wait here, so workers never block on a full work
+        # queue that only they could drain
+        discovered = asyncio.Queue()
+        seen = set()
+        outstanding = 0
+        finished = asyncio.Event()
+
+        def schedule(new_urls):
+            nonlocal outstanding
+            for url in new_urls:
+                if url not in seen:
+                    seen.add(url)
+                    outstanding += 1
+                    discovered.put_nowait(url)
+
+        async def feeder():
+            while True:
+                await work.put(await discovered.get())
+
+        async def worker():
+            nonlocal outstanding
+            while True:
+                url = await work.get()
+                try:
+                    body = await self.fetch(url)
+                    if body is not None:
+                        parsed = parse(url, body)
+                        if asyncio.iscoroutine(parsed):
+                            parsed = await parsed
+                        new_urls, item = parsed
+                        if self.manifest is not None:
+                            self.manifest.set_parse_status(url, 'ok')
+                        schedule(new_urls)
+                        if item is not None:
+                            await results.put(item)
+                except Exception as e:
+                    logger.exception(f'Failed to process {url}: {e}')
+                    if self.manifest is not None:
+                        self.manifest.set_parse_status(url, f'error: {e}')
+                finally:
+                    outstanding -= 1
+                    if outstanding == 0:
+                        finished.set()
+
+        async def writer():
+            while True:
+                item = await results.get()
+                try:
+                    written = write(item)
+                    if asyncio.iscoroutine(written):
+                        await written
+                except Exception as e:
+                    logger.exception(f'Failed to write item: {e}')
+                finally:
+                    results.task_done()
+
+        schedule(urls)
+        if outstanding == 0:
+            return
+        tasks = [asyncio.create_task(feeder()), asyncio.create_task(writer())]
+        tasks += [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            await finished.wait()
+            await results.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
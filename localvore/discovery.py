@@ -0,0 +1,124 @@
+import asyncio
+import html
+import json
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+from aiohttp import ClientError
+from loguru import logger
+
+from crawler import Crawler
+
+BB_ROOT = 'https://www.budgetbytes.com'
+
+
+async def find_last_page(exists: Callable[[int], Awaitable[bool]],
+                         fanout=8) -> int:
+    """Number of the last existing page of a paginated listing, given an
+    async exists(page) probe. Pages 1, 2, 4, ... are probed fanout at a time
+    until one is missing, then the gap is narrowed with fanout concurrent
+    probes per round, so a listing of n pages costs O(log n / log fanout)
+    rounds instead of n serial requests."""
+    if not await exists(1):
+        return 0
+    low, high, exponent = 1, None, 1
+    while high is None:
+        pages = [2 ** (exponent + i) for i in range(fanout)]
+        found = await asyncio.gather(*[exists(page) for page in pages])
+        for page, page_exists in zip(pages, found):
+            if not page_exists:
+                high = page
+                break
+            low = page
+        exponent += fanout
+    # low exists and high does not; search the pages strictly between
+    while high - low > 1:
+        step = max(1, (high - low) // (fanout + 1))
+        pages = list(range(low + step, high, step))[:fanout]
+        found = await asyncio.gather(*[exists(page) for page in pages])
+        for page, page_exists in zip(pages, found):
+            if page_exists:
+                low = page
+            else:
+                high = page
+                break
+    return low
+
+
+async def wp_rest_posts(crawler: Crawler, root: str, category: str,
+                        per_page=100) -> Optional[AsyncIterator[Tuple[str,
+                                                                      str]]]:
+    """(title, url) of every post in a WordPress category through the WP
+    REST API, or None when the site does not expose it. The page count
+    comes from the X-WP-TotalPages header of the first page; the remaining
+    pages are fetched concurrently and yielded as they arrive."""
+    try:
+        status, _, body = await crawler.request(
+            f'{root}/wp-json/wp/v2/categories?slug={category}&_fields=id')
+        categories = json.loads(body) if status == 200 else None
+        if not categories:
+            return None
+        listing = (f'{root}/wp-json/wp/v2/posts?categories='
+                   f'{categories[0]["id"]}&per_page={per_page}'
+                   f'&_fields=title,link&page=')
+        status, headers, first_page = await crawler.request(listing + '1')
+    except (ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.debug(f'WP REST API unavailable: {e}')
+        return None
+    if status != 200:
+        return None
+    total_pages = int(headers.get('X-WP-TotalPages', 1))
+
+    async def posts():
+        pages = [asyncio.ensure_future(crawler.fetch(listing + str(page)))
+                 for page in range(2, total_pages + 1)]
+        for post in json.loads(first_page):
+            yield html.unescape(post['title']['rendered']), post['link']
+        for page in pages:
+            for post in json.loads(await page or b'[]'):
+                yield html.unescape(post['title']['rendered']), post['link']
+    return posts()
+
+
+async def html_listing_posts(crawler: Crawler, page_url: str,
+                             title_selector: str, fanout=8
+                             ) -> AsyncIterator[Tuple[str, str]]:
+    """(title, url) of every post on plain, unrendered listing pages.
+    page_url is formatted with the page number. The last page is found by
+    find_last_page, then all pages are fetched concurrently."""
+    from lxml import html as lxml_html
+    from lxml.cssselect import CSSSelector
+    select = CSSSelector(title_selector)
+
+    async def exists(page):
+        status, _, _ = await crawler.request(page_url.format(page))
+        return status != 404
+
+    last_page = await find_last_page(exists, fanout)
+    logger.info(f'Found {last_page} listing pages')
+    pages = [asyncio.ensure_future(crawler.fetch(page_url.format(page)))
+             for page in range(1, last_page + 1)]
+    for page in pages:
+        body = await page
+        if not body:
+            continue
+        for element in select(lxml_html.fromstring(body)):
+            link = element if element.tag == 'a' else element.find('.//a')
+            url = link.get('href') if link is not None else None
+            yield ' '.join(element.text_content().split()), url
+
+
+async def discover_bb_recipes(root=BB_ROOT, category='recipes',
+                              title_selector='h4.title', **crawl_settings
+                              ) -> AsyncIterator[Tuple[str, str]]:
+    """Streams (title, url) of every BudgetBytes recipe without a browser:
+    through the WP REST API when available, otherwise from the plain html
+    of the category listing pages."""
+    async with Crawler(**crawl_settings) as crawler:
+        posts = await wp_rest_posts(crawler, root, category)
+        if posts is None:
+            logger.info('No WP REST API, falling back to html listings')
+            posts = html_listing_posts(
+                crawler, f'{root}/category/{category}/page/{{}}',
+                title_selector)
+        async for post in posts:
+            yield post
@@ -1,13 +1,14 @@
 from sklearn.manifold import TSNE
 import pandas as pd
 import altair as alt
-import pickle
 import numpy as np
 from pymongo import MongoClient
 import matplotlib.pyplot as plt
 
 
-from clustering import dbscan
+from clustering import seasonal_clusters
+from snapshot import SNAPSHOT_PATH, Snapshot
+from vector_format import decode_vectors
 MONGOPATH = 'mongodb://localhost:27017/'
 
 
@@ -17,11 +18,18 @@ def read_mongo(collection, query={}, noid=True):
     df = pd.DataFrame(list(cursor))
     if noid:
         del df['_id']
-    df['vector'] = df['vector'].apply(pickle.loads)
+    df['vector'] = list(decode_vectors(df['vector']))
 
     return df
 
 
+def read_snapshot(collection, path=None):
+    """Like read_mongo, but from a snapshot written by
+    snapshot.export_snapshot. The vector column holds views into the
+    memory-mapped matrix, so nothing is unpickled."""
+    return Snapshot(path or SNAPSHOT_PATH / collection).to_pandas()
+
+
 def t_sne(df):
 
     X = df['vector'].values
@@ -43,5 +51,14 @@ def plot_tsne(df):
     chart.serve()
 
 
-def plot_dbscan(state)
-    clusters = dbscan(state)
\ No newline at end of file
+def plot_clusters(state, collection='BB'):
+    """Sizes of the largest seasonal recipe clusters, labelled by the recipe
+    nearest each centroid"""
+    clusters = pd.DataFrame(seasonal_clusters(state, collection, 20))
+    chart = alt.Chart(clusters).mark_bar().encode(
+        x='size:Q',
+        y=alt.Y('name:N', sort='-x'),
+        tooltip=['cluster_label:N', 'size:Q']
+    )
+
+    chart.serve()
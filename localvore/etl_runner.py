@@ -0,0 +1,277 @@
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+import click
+from loguru import logger
+from pymongo import MongoClient
+
+from ETL_pipeline import (CACHE_DIR, CHECKPOINTS, MONGOPATH, _batched,
+                          _insert_batch, filter_predictions,
+                          ingredient_vectorization, insert_ingredients,
+                          load_predictions, stream_recipes)
+from recipe_index import INDEX_PATH
+from vector_table import TABLE_PATH, IngredientVectorTable
+
+# Distinct ingredients handed to the vector table per add, which rewrites
+# the table on disk every time
+VOCABULARY_CHUNK = 100000
+
+
+@lru_cache(maxsize=None)
+def _client(mongopath: str, pid: int) -> MongoClient:
+    # One client per process, shared by every task it runs. The pid is part
+    # of the key so forked workers never reuse the parent's client.
+    return MongoClient(mongopath)
+
+
+def _collection(mongopath: str, collection: str):
+    return _client(mongopath, os.getpid()).RECIPES[collection]
+
+
+class StageMarkers:
+    """
+    Completion markers of a parallel ETL run, one document per finished
+    (stage, part) in the checkpoints collection next to the recipes. How
+    the input was cut into parts (a batch size or a shard count) is part of
+    the marker, so resuming with other settings redoes the stage rather
+    than skipping parts that were cut differently.
+    """
+    def __init__(self, collection):
+        self.checkpoints = collection.database[CHECKPOINTS]
+        self.prefix = f'etl:{collection.name}:'
+
+    def _id(self, stage: str, part: int, cut: str) -> str:
+        return f'{self.prefix}{stage}:{cut}:{part}'
+
+    def done(self, stage: str, part=0, cut='all') -> bool:
+        return self.checkpoints.find_one(
+            {'_id': self._id(stage, part, cut)}) is not None
+
+    def finished(self, stage: str, cut: str) -> Set[int]:
+        """Parts of a stage already done, fetched in one query"""
+        return {marker['part'] for marker in self.checkpoints.find(
+            {'_id': {'$regex': f'^{re.escape(self.prefix)}'},
+             'stage': stage, 'cut': cut}, {'part': 1})}
+
+    def mark(self, stage: str, part=0, cut='all', **info):
+        self.checkpoints.replace_one(
+            {'_id': self._id(stage, part, cut)},
+            {'stage': stage, 'part': part, 'cut': cut,
+             'finished': datetime.utcnow(), **info},
+            upsert=True)
+
+    def plan(self, stage: str, make: Callable[[], List]) -> List:
+        """Shard boundaries of a stage, computed once and kept so a resumed
+        run cuts the same shards"""
+        key = f'{self.prefix}{stage}:plan'
+        doc = self.checkpoints.find_one({'_id': key})
+        if doc is None:
+            doc = {'_id': key, 'bounds': make()}
+            self.checkpoints.replace_one({'_id': key}, doc, upsert=True)
+        return doc['bounds']
+
+    def clear(self):
+        self.checkpoints.delete_many(
+            {'_id': {'$regex': f'^{re.escape(self.prefix)}'}})
+
+
+def insert_batch(mongopath: str, collection: str, batch: List[Dict]) -> int:
+    """Inserts one batch of layer1.json recipes streamed by the parent"""
+    return _insert_batch(batch, _collection(mongopath, collection))
+
+
+def predictions_batch(mongopath: str, collection: str, frame,
+                      batch_size=1000) -> int:
+    """Filters and writes one frame of ingredient predictions"""
+    return insert_ingredients(filter_predictions(frame),
+                              _collection(mongopath, collection), batch_size)
+
+
+def vectorize_shard(mongopath: str, collection: str, id_range: Tuple,
+                    table_path: str, batch_size=1000) -> int:
+    """Vectorizes one _id range. The vocabulary stage has already put
+    every ingredient in the table, so workers open it read-only: none loads
+    spaCy or writes the table, and a miss fails the shard."""
+    col = _collection(mongopath, collection)
+    ingredient_vectorization(col, batch_size, table_path=table_path,
+                             id_range=tuple(id_range), read_only=True)
+    return col.count_documents({'_id': _range_query(id_range),
+                                'vector': {'$exists': True}})
+
+
+def _range_query(id_range) -> Dict:
+    lower, upper = id_range
+    query = dict()
+    if lower is not None:
+        query['$gte'] = lower
+    if upper is not None:
+        query['$lt'] = upper
+    return query or {'$exists': True}
+
+
+def id_ranges(collection, shards: int) -> List[List]:
+    """Splits the _ids of recipes with ingredients into shards contiguous
+    ranges of about equal size, [lower, upper) with open outer ends"""
+    ids = [recipe['_id'] for recipe in
+           collection.find({'ingredients': {'$exists': True}}, {'_id': 1})
+           .sort('_id', 1)]
+    cuts = [ids[len(ids) * i // shards] for i in range(1, shards)]
+    bounds = [None] + list(dict.fromkeys(cuts)) + [None]
+    return [[lower, upper] for lower, upper in zip(bounds, bounds[1:])]
+
+
+def distinct_ingredients(collection, chunk_size=VOCABULARY_CHUNK):
+    """Yields the distinct ingredients of recipes still without a vector
+    in lists of at most chunk_size. An aggregation cursor is used instead
+    of distinct, whose result is a single document and so capped at 16 MB."""
+    cursor = collection.aggregate(
+        [{'$match': {'ingredients': {'$exists': True},
+                     'vector': {'$exists': False}}},
+         {'$unwind': '$ingredients'},
+         {'$group': {'_id': '$ingredients'}}],
+        allowDiskUse=True)
+    for batch in _batched(cursor, chunk_size):
+        yield [group['_id'] for group in batch]
+
+
+def run_stage(stage: str, fn: Callable, tasks: Iterable[Tuple], markers:
+              StageMarkers, executor, cut: str, in_flight: int = None) -> int:
+    """Runs fn(*args) for every task not yet marked done under cut and marks
+    each as it finishes, keyed on its position in tasks. tasks is consumed
+    lazily and at most in_flight of them are submitted at a time, so a
+    stream read by the parent never runs far ahead of the workers. A failed
+    task does not stop the others; the stage raises afterwards so a resumed
+    run retries only what failed."""
+    done = markers.finished(stage, cut)
+    if done:
+        logger.info(f'{stage}: {len(done)} parts already done')
+    start, total, failed, futures = time.perf_counter(), 0, [], dict()
+
+    def collect(finished):
+        nonlocal total
+        for future in finished:
+            part = futures.pop(future)
+            try:
+                count = future.result()
+            except Exception as e:
+                logger.error(f'{stage} part {part} failed: {e!r}')
+                failed.append(part)
+                continue
+            markers.mark(stage, part, cut, count=count)
+            total += count
+
+    submitted = 0
+    for part, args in enumerate(tasks):
+        if part in done:
+            continue
+        if in_flight and len(futures) >= in_flight:
+            collect(wait(futures, return_when=FIRST_COMPLETED).done)
+        futures[executor.submit(fn, *args)] = part
+        submitted += 1
+    collect(wait(futures).done)
+    logger.info(f'{stage}: {submitted - len(failed)} parts, {total} '
+                f'records in {time.perf_counter() - start:.1f}s')
+    if failed:
+        raise RuntimeError(f'{stage} failed for parts {sorted(failed)}, '
+                           f'rerun with --resume')
+    return total
+
+
+def run_pipeline(mongopath=MONGOPATH, collection='recipe1M',
+                 layer1: str = None, predictions: str = None,
+                 vectorization=True, shards: int = None,
+                 workers: int = None, batch_size=1000, resume=False,
+                 cache_dir=CACHE_DIR, table_path=TABLE_PATH,
+                 index_dir=INDEX_PATH, executor=ProcessPoolExecutor,
+                 nlp=None):
+    """Runs the ETL stages in order on a pool of workers processes. The
+    input files are parsed once, by this process, and their batches are
+    written by the pool with a bounded number in flight; vectorization is
+    split into shards of _ids. Without resume every marker of the
+    collection is cleared first; with it, finished parts are skipped."""
+    workers = workers or os.cpu_count()
+    shards = shards or 4 * workers
+    in_flight = 2 * workers
+    batches = f'batch{batch_size}'
+    col = _collection(mongopath, collection)
+    markers = StageMarkers(col)
+    if not resume:
+        markers.clear()
+    with executor(workers) as pool:
+        if layer1:
+            run_stage('insert', insert_batch,
+                      ((mongopath, collection, batch) for batch in
+                       _batched(stream_recipes(layer1), batch_size)),
+                      markers, pool, batches, in_flight)
+        if predictions:
+            run_stage('predictions', predictions_batch,
+                      ((mongopath, collection, frame, batch_size)
+                       for frame in load_predictions(predictions, batch_size,
+                                                     cache_dir)),
+                      markers, pool, batches, in_flight)
+        if not vectorization:
+            return
+        # Not skipped on resume: recipes added since the last run may bring
+        # new ingredients, and only this process may write the table
+        with IngredientVectorTable(table_path, nlp=nlp) as table:
+            for chunk in distinct_ingredients(col):
+                table.add(chunk)
+        bounds = markers.plan('vectorize', lambda: id_ranges(col, shards))
+        run_stage('vectorize', vectorize_shard,
+                  [(mongopath, collection, id_range, str(table_path),
+                    batch_size) for id_range in bounds],
+                  markers, pool, f'shards{len(bounds)}')
+    if not markers.done('index'):
+        # Imported here so pool workers never load sklearn
+        from ingredient_index import build_ingredient_index
+        from recipe_clusters import update_clusters
+        from recipe_index import update_index
+        index = update_index(col, index_dir, batch_size)
+        build_ingredient_index(col, index)
+        if len(index):
+            update_clusters(index)
+        markers.mark('index', count=len(index))
+
+
+@click.command()
+@click.option('--layer1', default=None, help='Layer1 json filepath')
+@click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--collection', default='recipe1M',
+              help='Recipe collection to build')
+@click.option('--batch-size', default=1000, type=int,
+              help='Number of recipes per bulk write')
+@click.option('--prediction_url', default=None,
+              help='URL or filepath to LSTM predictions')
+@click.option('--cache-dir', default=str(CACHE_DIR),
+              help='Where downloaded prediction files are cached')
+@click.option('--vectorization/--no-vectorization', default=True,
+              help='Whether to calculate recipe vectors and indexes')
+@click.option('--workers', default=None, type=int,
+              help='Worker processes, defaults to one per core')
+@click.option('--shards', default=None, type=int,
+              help='Vectorization shards, defaults to four per worker')
+@click.option('--resume', is_flag=True,
+              help='Skip work finished by an earlier, interrupted run')
+@click.option('--vector-table', default=str(TABLE_PATH),
+              help='Directory of the ingredient vector lookup table')
+@click.option('--index-dir', default=str(INDEX_PATH),
+              help='Directory of the recipe vector indexes')
+def main(layer1, mongopath, collection, batch_size, prediction_url,
+         cache_dir, vectorization, workers, shards, resume, vector_table,
+         index_dir):
+    """Parallel ETL_pipeline: every stage is split into batches or shards
+    processed on all cores, and finished ones are recorded so --resume
+    continues an interrupted rebuild."""
+    run_pipeline(mongopath, collection, layer1, prediction_url,
+                 vectorization, shards, workers, batch_size, resume,
+                 Path(cache_dir), Path(vector_table), Path(index_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+from loguru import logger
+
+WORD = re.compile(r'[a-z]+')
+# Versioned, so indexes saved before postings held ingredient slots are
+# ignored (and matched in Mongo) until the ETL rebuilds them
+INGREDIENTS_FILE = 'ingredients.v2.npz'
+
+
+def normalize_token(word: str) -> str:
+    """Lowercase, crudely singular form of a word, so that 'Tomatoes' in a
+    recipe matches the 'tomato' card on seasonalfoodguide"""
+    word = word.lower()
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(ingredient: str) -> List[str]:
+    return [normalize_token(word) for word in WORD.findall(ingredient.lower())]
+
+
+class InvertedIndex:
+    """
+    Normalized ingredient token -> posting list of ingredient slots.
+
+    Every ingredient of every recipe gets a slot, numbered in recipe order,
+    and the slots array maps each slot to its recipe row. Rows are positions
+    in the ids array saved alongside (the same ordering as the collection's
+    RecipeIndex when built from it). Posting lists are sorted, delta-encoded
+    uint32 arrays concatenated into one buffer with an offsets array, stored
+    in a compressed npz file.
+
+    A seasonal item matches a recipe when every one of its tokens occurs in
+    a single ingredient of it, i.e. the intersection of the item's posting
+    lists mapped to rows, so 'green beans' does not match a recipe with
+    'green onion' and 'black beans'. Items are then combined by counting, so
+    the result both selects the seasonal recipes (count > 0) and ranks them
+    by how many seasonal items they use.
+    """
+    def __init__(self, ids: np.ndarray, slots: np.ndarray,
+                 tokens: Dict[str, int], offsets: np.ndarray,
+                 deltas: np.ndarray):
+        self.ids = ids
+        self.slots = slots
+        self.tokens = tokens
+        self.offsets = offsets
+        self.deltas = deltas
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return (self.ids.nbytes + self.slots.nbytes + self.offsets.nbytes
+                + self.deltas.nbytes)
+
+    @classmethod
+    def build(cls, ids: Iterable, ingredients: Iterable[List[str]]):
+        postings: Dict[str, List[int]] = dict()
+        slots: List[int] = []
+        ids = np.array([str(_id) for _id in ids], dtype=object)
+        for row, recipe in enumerate(ingredients):
+            for item in recipe:
+                tokens = set(tokenize(item))
+                if not tokens:
+                    continue
+                for token in tokens:
+                    postings.setdefault(token, []).append(len(slots))
+                slots.append(row)
+        vocab = sorted(postings)
+        lengths = [len(postings[token]) for token in vocab]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        deltas = np.empty(offsets[-1], dtype=np.uint32)
+        for token, start, end in zip(vocab, offsets[:-1], offsets[1:]):
+            found = np.array(postings[token], dtype=np.uint32)
+            deltas[start:end] = np.diff(found, prepend=np.uint32(0))
+        return cls(ids, np.array(slots, dtype=np.uint32),
+                   {token: i for i, token in enumerate(vocab)},
+                   offsets, deltas)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(Path(path), allow_pickle=False) as data:
+            tokens = json.loads(str(data['tokens']))
+            return cls(np.array(json.loads(str(data['ids'])), dtype=object),
+                       data['slots'],
+                       {token: i for i, token in enumerate(tokens)},
+                       data['offsets'], data['deltas'])
+
+    def save(self, path: Path):
+        vocab = sorted(self.tokens, key=self.tokens.get)
+        np.savez_compressed(Path(path), ids=json.dumps(self.ids.tolist()),
+                            slots=self.slots, tokens=json.dumps(vocab),
+                            offsets=self.offsets, deltas=self.deltas)
+
+    def postings(self, token: str) -> np.ndarray:
+        if token not in self.tokens:
+            return np.empty(0, dtype=np.int64)
+        i = self.tokens[token]
+        return np.cumsum(self.deltas[self.offsets[i]:self.offsets[i + 1]],
+                         dtype=np.int64)
+
+    def match(self, item: str) -> np.ndarray:
+        """Rows of recipes with an ingredient containing every token of
+        item"""
+        tokens = tokenize(item)
+        if not tokens:
+            return np.empty(0, dtype=np.int64)
+        found = self.postings(tokens[0])
+        for token in tokens[1:]:
+            found = np.intersect1d(found, self.postings(token),
+                                   assume_unique=True)
+        return np.unique(self.slots[found]).astype(np.int64)
+
+    def coverage(self, items: Iterable[str],
+                 align_to: np.ndarray = None) -> np.ndarray:
+        """Number of items used by every recipe. With align_to, counts are
+        reordered to match that id array (e.g. a collection matrix), with
+        zeros for ids missing from this index."""
+        matches = [self.match(item) for item in items]
+        matches = np.concatenate(matches) if matches else np.empty(0, int)
+        counts = np.bincount(matches, minlength=len(self)).astype(np.int32)
+        if align_to is None:
+            return counts
+        import pandas as pd
+        positions = pd.Index(self.ids).get_indexer(
+            np.asarray(align_to, dtype=object))
+        aligned = np.zeros(len(positions), dtype=np.int32)
+        found = positions >= 0
+        aligned[found] = counts[positions[found]]
+        return aligned
+
+
+def build_ingredient_index(collection, index) -> InvertedIndex:
+    """Builds the inverted index of a collection aligned with the rows of
+    its RecipeIndex, in one projection-only scan, and saves it next to it"""
+    rows = {_id: row for row, _id in enumerate(index.ids)}
+    ingredients = [[] for _ in rows]
+    for recipe in collection.find({'ingredients': {'$exists': True}},
+                                  {'ingredients': 1}):
+        row = rows.get(str(recipe['_id']))
+        if row is not None:
+            ingredients[row] = recipe['ingredients']
+    inverted = InvertedIndex.build(index.ids, ingredients)
+    inverted.save(index.path / INGREDIENTS_FILE)
+    logger.info(f'Indexed {len(inverted.tokens)} ingredient tokens for '
+                f'{collection.name}')
+    return inverted
@@ -0,0 +1,228 @@
+import hashlib
+import inspect
+import json
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from pymongo import MongoClient, ReturnDocument
+
+MONGOPATH = 'mongodb://localhost:27017/'
+# Keyword arguments a request may pass to every algorithm
+ALGORITHMS = {'menu': ('n_recipes', 'seed', 'weight'),
+              'clusters': ('n_clusters',)}
+ACTIVE = ('queued', 'running')
+
+
+def run_clustering(algorithm: str, state: str, collections: List[str],
+                   progress: Callable[[float], None] = None, **params):
+    """Job body for POST /api/cluster. Runs in a pool process, so the heavy
+    clustering imports happen there rather than in the web worker.
+
+    The matrix, clusters and seasonal coverage of every collection are
+    loaded first, reporting progress after each collection, since they are
+    what makes a cold run slow; the algorithm then finds them cached."""
+    import clustering
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f'Unknown algorithm {algorithm}')
+    if algorithm == 'clusters':
+        collections = collections[:1]
+    for done, collection in enumerate(collections, 1):
+        clustering.collection_clusters(collection)
+        clustering.seasonal_coverage(collection, state)
+        if progress is not None:
+            progress(done / (len(collections) + 1))
+    if algorithm == 'menu':
+        return clustering.clustering(state, collections, **params)
+    return clustering.seasonal_clusters(state, collections[0], **params)
+
+
+@lru_cache(maxsize=None)
+def _jobs_collection(mongo_path: str, collection: str):
+    # One client per process, shared by every job it runs
+    return MongoClient(mongo_path).RECIPES[collection]
+
+
+def _accepts_progress(fn: Callable) -> bool:
+    try:
+        return 'progress' in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _run_job(mongo_path: str, collection: str, job_id: str, fn: Callable,
+             args, kwargs):
+    """Marks the job running from the pool process, then runs it. A
+    function with a progress parameter gets a callback storing its value,
+    a fraction between 0 and 1, in the job record."""
+    jobs = _jobs_collection(mongo_path, collection)
+    jobs.update_one({'_id': job_id, 'status': 'queued'},
+                    {'$set': {'status': 'running', 'started': time.time()}})
+    if _accepts_progress(fn):
+        def progress(value: float):
+            jobs.update_one({'_id': job_id, 'status': 'running'},
+                            {'$set': {'progress': float(value)}})
+        kwargs = dict(kwargs, progress=progress)
+    return fn(*args, **kwargs)
+
+
+class JobQueue:
+    """
+    Runs long jobs on a local process pool and keeps their state in the
+    RECIPES.jobs collection, so a web worker only enqueues and looks up, and
+    any worker can answer for a job submitted to another.
+
+    - submit() returns a job id at once. Submitting a function and
+      arguments identical to a queued or running job, in any worker,
+      returns that job's id instead of starting another run. Jobs in flight
+      are tracked in RECIPES.jobs.in_flight, one document per run.
+    - status() reports the job's state ('queued', 'running', 'done' or
+      'failed'), its owner, progress and timings and, once finished, its
+      result or error.
+    - The worker owning a job's pool refreshes its heartbeat every
+      heartbeat seconds. A queued or running job whose heartbeat is older
+      than stale seconds lost its worker: it is marked failed and stops
+      absorbing new submissions.
+    - Finished jobs are forgotten keep seconds after they end.
+    """
+    def __init__(self, mongo_path=MONGOPATH, collection='jobs',
+                 workers: int = None, keep: float = 3600,
+                 heartbeat: float = 10, stale: float = 60,
+                 executor: Callable[[int], Executor] = ProcessPoolExecutor):
+        self.mongo_path = mongo_path
+        self.collection_name = collection
+        self.collection = MongoClient(mongo_path).RECIPES[collection]
+        self.in_flight = self.collection.database[f'{collection}.in_flight']
+        self.workers = workers
+        self.keep = keep
+        self.heartbeat = heartbeat
+        self.stale = stale
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._make_executor = executor
+        self._executor: Optional[Executor] = None
+        self._futures: Dict[str, Future] = dict()
+        self._stopped = Event()
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> Executor:
+        # Started on first use, so importing the app spawns no processes
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._make_executor(self.workers)
+                Thread(target=self._beat, daemon=True).start()
+        return self._executor
+
+    def _beat(self):
+        while not self._stopped.wait(self.heartbeat):
+            with self._lock:
+                job_ids = list(self._futures)
+            if job_ids:
+                self.collection.update_many(
+                    {'_id': {'$in': job_ids}, 'status': {'$in': ACTIVE}},
+                    {'$set': {'heartbeat': time.time()}})
+
+    @staticmethod
+    def _key(fn: Callable, args, kwargs) -> str:
+        return hashlib.sha1(json.dumps(
+            [fn.__module__, fn.__qualname__, args, kwargs],
+            sort_keys=True, default=str).encode()).hexdigest()
+
+    def _fail_stale(self, query: Dict):
+        """Marks active jobs matching query whose heartbeat is older than
+        stale as failed, and releases their claims"""
+        now = time.time()
+        for job in self.collection.find(
+                {**query, 'status': {'$in': ACTIVE},
+                 'heartbeat': {'$lt': now - self.stale}}, {'owner': 1}):
+            logger.warning(f'Job {job["_id"]} lost its worker {job["owner"]}')
+            self.collection.update_one(
+                {'_id': job['_id'], 'status': {'$in': ACTIVE}},
+                {'$set': {'status': 'failed', 'finished': now,
+                          'error': f'Worker {job["owner"]} stopped '
+                                   f'responding'}})
+            self.in_flight.delete_many({'job': job['_id']})
+
+    def _claim(self, key: str, job_id: str) -> str:
+        """Id of the job in flight for key, registering job_id when there is
+        none. The upsert makes the claim atomic across workers; a claim left
+        behind by a job that already ended is dropped."""
+        claim = self.in_flight.find_one_and_update(
+            {'_id': key},
+            {'$setOnInsert': {'job': job_id, 'submitted': time.time()}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        if claim['job'] != job_id:
+            other = self.collection.find_one({'_id': claim['job']},
+                                             {'status': 1})
+            if other is None or other['status'] not in ACTIVE:
+                self.in_flight.delete_one({'_id': key, 'job': claim['job']})
+                return self._claim(key, job_id)
+        return claim['job']
+
+    def submit(self, fn: Callable, *args, **kwargs) -> str:
+        self._expire()
+        self._fail_stale(dict())
+        key = self._key(fn, args, kwargs)
+        job_id, now = uuid.uuid4().hex, time.time()
+        # Stored before it is claimed, so a worker handed its id can find it
+        self.collection.insert_one(
+            {'_id': job_id, 'status': 'queued', 'owner': self.owner,
+             'submitted': now, 'heartbeat': now, 'started': None,
+             'finished': None, 'progress': None})
+        claimed = self._claim(key, job_id)
+        if claimed != job_id:
+            self.collection.delete_one({'_id': job_id})
+            return claimed
+        future = self.executor.submit(_run_job, self.mongo_path,
+                                      self.collection_name, job_id, fn,
+                                      args, kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(
+            lambda done: self._finish(job_id, key, done))
+        return job_id
+
+    def _finish(self, job_id: str, key: str, future: Future):
+        finished = {'finished': time.time()}
+        try:
+            finished['result'] = future.result()
+            finished['status'] = 'done'
+            finished['progress'] = 1.0
+        except Exception as e:
+            logger.warning(f'Job {job_id} failed: {e!r}')
+            finished['error'] = repr(e)
+            finished['status'] = 'failed'
+        job = self.collection.find_one_and_update(
+            {'_id': job_id, 'status': {'$in': ACTIVE}}, {'$set': finished},
+            return_document=ReturnDocument.AFTER)
+        if job is not None and job['started'] is None:
+            self.collection.update_one({'_id': job_id},
+                                       {'$set': {'started': job['submitted']}})
+        self.in_flight.delete_one({'_id': key, 'job': job_id})
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def _expire(self):
+        self.collection.delete_many(
+            {'finished': {'$ne': None, '$lt': time.time() - self.keep}})
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        self._fail_stale({'_id': job_id})
+        job = self.collection.find_one({'_id': job_id})
+        if job is None:
+            return None
+        job['id'] = job.pop('_id')
+        end = job['finished'] or time.time()
+        job['elapsed'] = end - (job['started'] or end)
+        return job
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait)
@@ -0,0 +1,86 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    status INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    parse_status TEXT,
+    fetched_at REAL,
+    checked_at REAL
+)
+'''
+
+
+class CrawlManifest:
+    """
+    SQLite record of every page a crawl has fetched: HTTP status, ETag,
+    Last-Modified, a hash of the body and whether it parsed.
+
+    The Crawler uses it to send conditional GETs and to drop pages whose
+    content has not changed since they were last parsed successfully, so a
+    re-crawl only parses new or changed pages.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(SCHEMA)
+        self.db.commit()
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def get(self, url: str) -> Optional[Dict]:
+        row = self.db.execute('SELECT * FROM pages WHERE url = ?',
+                              (url,)).fetchone()
+        return None if row is None else dict(row)
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        page = self.get(url)
+        headers = dict()
+        if page is not None and page['parse_status'] == 'ok':
+            if page['etag']:
+                headers['If-None-Match'] = page['etag']
+            if page['last_modified']:
+                headers['If-Modified-Since'] = page['last_modified']
+        return headers
+
+    def not_modified(self, url: str):
+        self.db.execute('UPDATE pages SET checked_at = ? WHERE url = ?',
+                        (time.time(), url))
+        self.db.commit()
+
+    def record(self, url: str, status: int, headers: Dict[str, str],
+               body: bytes) -> bool:
+        """Stores a fetched page. Returns whether it needs parsing, i.e. it
+        is new, its content changed, or it did not parse last time."""
+        content_hash = hashlib.sha1(body).hexdigest()
+        page = self.get(url)
+        changed = (page is None or page['content_hash'] != content_hash
+                   or page['parse_status'] != 'ok')
+        now = time.time()
+        self.db.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (url, status, headers.get('ETag'), headers.get('Last-Modified'),
+             content_hash, None if changed else 'ok', now, now))
+        self.db.commit()
+        return changed
+
+    def set_parse_status(self, url: str, parse_status: str):
+        self.db.execute('UPDATE pages SET parse_status = ? WHERE url = ?',
+                        (parse_status, url))
+        self.db.commit()
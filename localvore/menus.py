@@ -0,0 +1,157 @@
+import sys
+from datetime import datetime
+from itertools import count
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import click
+from loguru import logger
+from pymongo import MongoClient
+
+from cache import TTLCache
+from recipe_index import INDEX_PATH, index_count
+from seasonal import STATES, get_date
+from tracing import span
+
+MONGOPATH = 'mongodb://localhost:27017/'
+DEFAULT_COLLECTIONS = ('BB',)
+
+logger.add(sys.stderr)
+
+
+def menu_key(state: str, period: str, collections: Iterable[str]) -> str:
+    return f'{state}:{period}:{"+".join(sorted(collections))}'
+
+
+class MenuStore:
+    """
+    Precomputed menus per (state, period, collection set), persisted in the
+    RECIPES.menus collection and served from memory.
+
+    Each entry holds several candidate menus, handed out in turn by
+    next_menu, and the recipe count of every collection when it was
+    computed, so entries made before the recipe set changed are ignored.
+    Entries are filled by materialize(), run after each seasonal refresh.
+    """
+    def __init__(self, mongo_path=MONGOPATH, collection='menus', ttl=300):
+        self.collection = MongoClient(mongo_path).RECIPES[collection]
+        # Expiring, so menus rematerialized by the job are picked up
+        self._memory = TTLCache(max_bytes=2**20, ttl=ttl)
+        self._turns: Dict[str, count] = dict()
+        self._lock = Lock()
+
+    def get(self, state: str, collections: Iterable[str],
+            period: str = None) -> Optional[Dict]:
+        key = menu_key(state, period or get_date(), collections)
+        doc = self._memory.get(key)
+        if doc is None:
+            doc = self.collection.find_one({'_id': key})
+            if doc is not None:
+                self._memory.set(key, doc)
+        return doc
+
+    def put(self, state: str, collections: Iterable[str],
+            menus: List[List[str]], recipes: Dict[str, int],
+            period: str = None):
+        period = period or get_date()
+        key = menu_key(state, period, collections)
+        doc = {'_id': key, 'state': state, 'period': period,
+               'collections': sorted(collections), 'menus': menus,
+               'recipes': recipes, 'updated': datetime.utcnow()}
+        self.collection.replace_one({'_id': key}, doc, upsert=True)
+        self._memory.set(key, doc)
+        with self._lock:
+            self._turns.pop(key, None)
+
+    @span('menu_lookup')
+    def next_menu(self, state: str, collections: Iterable[str],
+                  recipes: Dict[str, int] = None,
+                  period: str = None) -> Optional[List[str]]:
+        """The next stored menu in rotation, or None when nothing is stored
+        or it was computed from other recipe counts than recipes"""
+        doc = self.get(state, collections, period)
+        if doc is None or not doc['menus'] or (
+                recipes is not None and doc['recipes'] != recipes):
+            return None
+        with self._lock:
+            turn = next(self._turns.setdefault(doc['_id'], count()))
+        return doc['menus'][turn % len(doc['menus'])]
+
+
+@span('recipe_counts')
+def recipe_counts(collections: Iterable[str]) -> Dict[str, int]:
+    """Rows in the recipe index of every collection. Read from the index
+    metadata, so checking stored menus loads neither vectors nor sklearn."""
+    counts = {collection: index_count(INDEX_PATH / collection)
+              for collection in collections}
+    if not all(counts.values()):
+        from clustering import collection_matrix
+        counts = {collection: count or len(collection_matrix(collection))
+                  for collection, count in counts.items()}
+    return counts
+
+
+def materialize(store: MenuStore, states: Iterable[str] = STATES,
+                collections: Iterable[str] = DEFAULT_COLLECTIONS,
+                n_menus=20, n_recipes=5, period: str = None,
+                make_menu: Callable = None) -> int:
+    """Computes up to n_menus distinct menus of every state for the current
+    period and stores them. Returns the number of states stored."""
+    if make_menu is None:
+        from clustering import clustering as make_menu
+    collections = sorted(collections)
+    recipes = recipe_counts(collections)
+    stored = 0
+    for state in states:
+        menus: Dict[Tuple[str, ...], None] = dict()
+        try:
+            for _ in range(3 * n_menus):
+                menus.setdefault(tuple(make_menu(state, collections,
+                                                 n_recipes)))
+                if len(menus) == n_menus:
+                    break
+        except Exception as e:
+            logger.warning(f'Could not compute menus for {state}: {e}')
+            continue
+        store.put(state, collections, [list(menu) for menu in menus],
+                  recipes, period)
+        stored += 1
+    logger.info(f'Stored menus of {stored} states for '
+                f'{"+".join(collections)}')
+    return stored
+
+
+def serve_menu(store: MenuStore, state: str,
+               collections: Iterable[str] = DEFAULT_COLLECTIONS,
+               n_recipes=5) -> List[str]:
+    """A stored menu when one is up to date, otherwise one computed on the
+    spot"""
+    collections = sorted(collections)
+    menu = store.next_menu(state, collections, recipe_counts(collections))
+    if menu is not None:
+        return menu
+    logger.warning(f'No stored menu for {state} from {collections}, '
+                   f'computing one')
+    from clustering import clustering
+    return clustering(state, collections, n_recipes)
+
+
+@click.command()
+@click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--state', 'states', multiple=True, default=STATES,
+              help='State to compute menus for, may be repeated')
+@click.option('--collection', 'collections', multiple=True,
+              default=DEFAULT_COLLECTIONS,
+              help='Recipe collection to draw from, may be repeated')
+@click.option('--menus', 'n_menus', default=20,
+              help='Candidate menus stored per state')
+@click.option('--recipes', 'n_recipes', default=5, help='Recipes per menu')
+def main(mongopath, states, collections, n_menus, n_recipes):
+    """Precomputes the menus served by the API. Run after every seasonal
+    refresh and after the ETL adds recipes."""
+    materialize(MenuStore(mongopath), states, collections, n_menus,
+                n_recipes)
+
+
+if __name__ == '__main__':
+    main()
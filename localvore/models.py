@@ -1,75 +1,108 @@
-import pickle
-import re
+import itertools
 import sys
+from functools import lru_cache
 from typing import List
 from threading import Thread
 
-import spacy
-from bson.binary import Binary
 from loguru import logger
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from tqdm import tqdm
 
 MONGOPATH = 'mongodb://localhost:27017/'
 STATE = 'tennessee'
-from scraper import get_seasonal_veggies
+from cache import TTLCache
+from normalize import normalize_recipes, strip_details
+from seasonal import SeasonalStore
+from tracing import span
+from vector_format import encode_vector
+from vector_table import IngredientVectorTable
 
 logger.add(sys.stderr)
+seasonal_store = SeasonalStore(MONGOPATH)
+collection_metadata = TTLCache(max_bytes=2**20, ttl=300)
 
 
-def backend_query(collection: str, state=STATE, mongo_path=MONGOPATH):
-    """Pings API from seasonalfoodguide, scrapes html, and finds set union
-    of veggies and recipe collection by keyword."""
-    client = MongoClient(mongo_path)
-    recipes = client.RECIPES[collection]
-    assert recipes.count_documents({}) > 0, "Invalid collection name entered"
-    veggies = get_seasonal_veggies(state)
-    result = recipes.find({'ingredients': {"$in": veggies}})
-    return result
+@lru_cache(maxsize=None)
+def get_client(mongo_path=MONGOPATH) -> MongoClient:
+    """One pooled MongoClient per server for the whole process"""
+    return MongoClient(mongo_path)
 
 
-def keyword_vectorization(collection: str):
-    """Large write operation to mongodb. Adds average word vector to each
-    document"""
-    nlp = spacy.load('en_core_web_lg')
-    collection = backend_query(collection)
-    for recipe in tqdm(collection.find()):
-        ingredients = " ".join([item.lower() for item in recipe['ingredients']])
-        tokens = nlp(ingredients)
-        recipe['vector'] = Binary(pickle.dumps(tokens.vector))
-        collection.save(recipe)
+def collection_names(mongo_path=MONGOPATH) -> List[str]:
+    """Recipe collection names, refreshed every few minutes instead of
+    counting documents on every query"""
+    database = get_client(mongo_path).RECIPES
+    return collection_metadata.get_or_load(mongo_path,
+                                           database.list_collection_names)
+
+
+def backend_query(collection: str, state=STATE, mongo_path=MONGOPATH,
+                  projection=None):
+    """Looks up the stored seasonalfoodguide produce for the state and
+    finds set union of veggies and recipe collection by keyword. Exact
+    string matching only; clustering uses the ingredient inverted index
+    instead when one has been built."""
+    assert collection in collection_names(mongo_path), \
+        "Invalid collection name entered"
+    recipes = get_client(mongo_path).RECIPES[collection]
+    with span('seasonal_lookup'):
+        veggies = seasonal_store.get(state)
+    result = recipes.find({'ingredients': {"$in": veggies}}, projection)
+    return result
 
 
-def strip_details(ingredients: List[str]):
-    """Removes everything in parentheses and after a comma in every string"""
-    no_parentheses = [re.sub(r'\([^()]*\)', '', string)
-                      for string in ingredients]
-    precomma = [re.findall(r'[^,]+', string)[0] for string in no_parentheses]
-    return precomma
+def keyword_vectorization(collection: str, mongo_path=MONGOPATH,
+                          batch_size=1000):
+    """Large write operation to mongodb. Adds average word vector to each
+    document, looked up from the ingredient vector table"""
+    recipes = MongoClient(mongo_path).RECIPES[collection]
+    cursor = tqdm(recipes.find({'ingredients': {'$exists': True}},
+                               {'ingredients': 1}))
+    with IngredientVectorTable() as table:
+        while True:
+            batch = list(itertools.islice(cursor, batch_size))
+            if not batch:
+                break
+            vectors = table.recipe_vectors([item['ingredients']
+                                            for item in batch])
+            recipes.bulk_write([UpdateOne({'_id': item['_id']},
+                                          {'$set': {'vector': encode_vector(
+                                              vector)}})
+                                for item, vector in zip(batch, vectors)])
 
 
-def trim_ingredients(mongo_path=MONGOPATH):
+def trim_ingredients(mongo_path=MONGOPATH, collection='BB',
+                     batch_size=1000) -> int:
     """Removes everything after comma and in parentheses for
-    existing documents"""
-    client = MongoClient(mongo_path)
-    db = client.RECIPES
-    col = db.BB
-    num_failures = 0
-    for recipe in tqdm(col.find()):
-        try:
-            recipe['ingredients'] = strip_details(recipe['ingredients'])
-        except Exception as e:
-            print(e)
-            num_failures += 1
-            print(num_failures)
-            pass
-        col.save(recipe)
+    existing documents, in a single pass of bulk writes. Returns the
+    number of documents changed."""
+    col = MongoClient(mongo_path).RECIPES[collection]
+    cursor = col.find({'ingredients': {'$exists': True}}, {'ingredients': 1})
+    modified = 0
+    with tqdm(total=col.count_documents({'ingredients': {'$exists': True}}),
+              unit=' recipes') as progress:
+        while True:
+            batch = list(itertools.islice(cursor, batch_size))
+            if not batch:
+                break
+            trimmed = normalize_recipes([recipe['ingredients']
+                                         for recipe in batch])
+            updates = [UpdateOne({'_id': recipe['_id']},
+                                 {'$set': {'ingredients': ingredients}})
+                       for recipe, ingredients in zip(batch, trimmed)
+                       if ingredients != recipe['ingredients']]
+            if updates:
+                modified += col.bulk_write(updates,
+                                           ordered=False).modified_count
+            progress.update(len(batch))
+    logger.info(f'Trimmed the ingredients of {modified} recipes')
+    return modified
 
 
 @logger.catch()
 def make_post(r):
-    """"Uses currently open Response object to test for existence of various CSS
-    tags. Returns dictionary for insertion into MongoDB, or None if the
+    """"Uses currently open Response object to test for existence of various
+    CSS tags. Returns dictionary for insertion into MongoDB, or None if the
     ingredients field is blank."""
     tags = {'title': 'h1.title',
             'cost': 'span.wprm-recipe-recipe_cost',
@@ -0,0 +1,59 @@
+import itertools
+import re
+import sys
+from functools import lru_cache
+from typing import Iterable, List
+
+import numpy as np
+
+PARENTHESES = re.compile(r'\([^()]*\)')
+SEGMENT = re.compile(r'[^,]+')
+
+
+@lru_cache(maxsize=2 ** 17)
+def normalize_ingredient(raw: str) -> str:
+    """Removes everything in parentheses and after the first comma, e.g.
+    'onion (1/2), diced' -> 'onion '. Nested parentheses are removed from
+    the inside out. A leading comma is skipped rather than crashing, and a
+    string of nothing but commas normalizes to ''."""
+    text, removed = PARENTHESES.subn('', raw)
+    while removed:
+        text, removed = PARENTHESES.subn('', text)
+    segment = SEGMENT.search(text)
+    return segment.group() if segment else ''
+
+
+def normalize_ingredients(values):
+    """Normalizes a list, NumPy object array or pandas Series of raw
+    ingredient strings. Every distinct string goes through
+    normalize_ingredient once, and its cache carries over between calls.
+    Returns an object array, or a Series with the same index for a
+    Series."""
+    raw = np.asarray(values, dtype=object).ravel()
+    # A plain dict rather than pd.factorize, which truncates strings at NUL
+    distinct = {item: normalize_ingredient(item) for item in set(raw)}
+    result = np.empty(len(raw), dtype=object)
+    result[:] = [distinct[item] for item in raw]
+    # pandas is only loaded if the caller already passed a Series
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name)
+    return result
+
+
+def strip_details(ingredients: Iterable[str]) -> List[str]:
+    """Removes everything in parentheses and after a comma in every string"""
+    return normalize_ingredients(list(ingredients)).tolist()
+
+
+def normalize_recipes(recipes: List[List[str]]) -> List[List[str]]:
+    """Normalizes the ingredient lists of many recipes in one batch"""
+    if not recipes:
+        return list()
+    lengths = np.fromiter((len(recipe) for recipe in recipes), dtype=np.int64,
+                          count=len(recipes))
+    flat = np.array(list(itertools.chain.from_iterable(recipes)),
+                    dtype=object)
+    normalized = normalize_ingredients(flat)
+    return [part.tolist() for part in
+            np.split(normalized, np.cumsum(lengths)[:-1])]
@@ -0,0 +1,115 @@
+from typing import Dict, List, Optional
+
+# Tags at these keys describe the listing pages, not the recipe itself
+LISTING_KEYS = ('root_url', 'pagination', 'nav_title')
+# Fields holding a list of items (one per <li>) rather than a single text
+LIST_FIELDS = ('ingredients', 'instructions')
+BACKENDS = ('lxml', 'bs4')
+
+ella_tags = {
+    'root_url': 'https://naturallyella.com',
+    'pagination': 46,
+    'nav_title': 'h2.entry-title',
+    'title': 'h1.entry-title',
+    'category': 'span.tasty-recipes-category',
+    'full_recipe': 'div.tasty-recipes-entry-content',
+    'ingredients': 'div.tasty-recipes-ingredients',
+    'instructions': 'div.tasty-recipes-instructions',
+    'notes':  'div.tasty-recipes-notes',
+    'keywords': 'em'
+}
+# Tags of every scraped site, by the collection (and folder) it is saved to
+SITE_TAGS = {'ella': ella_tags}
+
+
+class RecipeExtractor:
+    """
+    Extracts a recipe post from raw HTML using the CSS selectors of a
+    RecipeScraper tags dict.
+
+    Selectors are compiled once, on first use, by the chosen backend: lxml
+    with cssselect (fast, the default) or BeautifulSoup with soupsieve.
+    Compiled selectors are dropped when pickling, so an extractor can be
+    shipped to ProcessPoolExecutor workers, which compile their own copy.
+
+    The post holds the text of every recipe field, ingredients and
+    instructions as lists of their <li> items, keywords split on commas,
+    and the HTML of the 'full_recipe' element under 'full_recipe'. None is
+    returned when the page has no full_recipe element.
+    """
+    def __init__(self, tags: Dict, backend='lxml'):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown parser backend {backend}')
+        self.tags = tags
+        self.backend = backend
+        self.fields = {key: val for key, val in tags.items()
+                       if key not in LISTING_KEYS}
+        self._selectors = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_selectors'] = None
+        return state
+
+    def _compile(self):
+        if self.backend == 'lxml':
+            from lxml.cssselect import CSSSelector
+            compile_selector = CSSSelector
+        else:
+            import soupsieve
+            compile_selector = soupsieve.compile
+        selectors = {key: compile_selector(val)
+                     for key, val in self.fields.items()}
+        for key in LIST_FIELDS:
+            if key in self.fields:
+                selectors[f'{key}_items'] = compile_selector(
+                    f'{self.fields[key]} li')
+        return selectors
+
+    def _parse(self, html):
+        if self.backend == 'lxml':
+            from lxml import html as lxml_html
+            return lxml_html.fromstring(html)
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(html, 'html.parser')
+
+    def _select(self, key, root) -> List:
+        if self.backend == 'lxml':
+            return self._selectors[key](root)
+        return self._selectors[key].select(root)
+
+    def _text(self, element) -> str:
+        if self.backend == 'lxml':
+            return ' '.join(element.text_content().split())
+        return ' '.join(element.get_text().split())
+
+    def _html(self, element) -> str:
+        if self.backend == 'lxml':
+            from lxml import html as lxml_html
+            return lxml_html.tostring(element, encoding='unicode')
+        return element.decode()
+
+    def __call__(self, html) -> Optional[Dict]:
+        if self._selectors is None:
+            self._selectors = self._compile()
+        root = self._parse(html)
+        full_recipe = self._select('full_recipe', root)
+        if not full_recipe:
+            return None
+        post = {'full_recipe': self._html(full_recipe[0])}
+        for key in self.fields:
+            if key == 'full_recipe':
+                continue
+            if key in LIST_FIELDS:
+                items = [self._text(item) for item in
+                         self._select(f'{key}_items', root)]
+                if items:
+                    post[key] = items
+                continue
+            found = self._select(key, root)
+            if found:
+                post[key] = self._text(found[0])
+        if 'keywords' in post:
+            post['keywords'] = [keyword.strip() for keyword in
+                                post['keywords'].split(',')]
+        return post
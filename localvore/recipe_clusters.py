@@ -0,0 +1,138 @@
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from recipe_index import RecipeIndex
+from tracing import span
+
+CLUSTERS_DIR = 'clusters'
+
+
+class RecipeClusters:
+    """
+    Cluster label of every row of a RecipeIndex, with the model that
+    assigned them, persisted next to the index in a clusters directory:
+        - mean.npy, components.npy: PCA projection to a few dimensions
+        - centroids.npy: k-means centroids in the projected space
+        - labels.npy: int32 cluster of every index row
+        - meta.json: shapes and the row count labelled
+
+    fit() projects and clusters a random sample of rows, which is enough to
+    place the centroids, then labels every row in chunks by its nearest
+    centroid, so a million vectors take minutes rather than the hours of
+    OPTICS. Rows appended to the index later are labelled by update()
+    without refitting.
+    """
+    def __init__(self, path: Path = None):
+        self.path = None if path is None else Path(path)
+        self.mean = self.components = self.centroids = None
+        self.labels = np.empty(0, dtype=np.int32)
+        if self.path is not None and (self.path / 'meta.json').exists():
+            self._load()
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def n_clusters(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.mean, self.components,
+                                              self.centroids, self.labels)
+                   if array is not None)
+
+    def _load(self):
+        self.mean = np.load(self.path / 'mean.npy')
+        self.components = np.load(self.path / 'components.npy')
+        self.centroids = np.load(self.path / 'centroids.npy')
+        count = json.loads((self.path / 'meta.json').read_text())['count']
+        self.labels = np.load(self.path / 'labels.npy')[:count]
+
+    def save(self, path: Path = None):
+        self.path = Path(path or self.path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        for name in ('mean', 'components', 'centroids', 'labels'):
+            np.save(self.path / f'{name}.npy', getattr(self, name))
+        # meta.json is written last, so an interrupted save is ignored
+        (self.path / 'meta.json').write_text(json.dumps(
+            {'count': len(self), 'clusters': self.n_clusters,
+             'components': len(self.components), 'dim': len(self.mean)}))
+
+    @classmethod
+    @span('fit_clusters')
+    def fit(cls, index: RecipeIndex, n_clusters=256, n_components=64,
+            sample=100000, seed=0) -> 'RecipeClusters':
+        # Only fitting needs sklearn; serving loads saved clusters
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.decomposition import PCA
+        start = time.perf_counter()
+        rng = np.random.RandomState(seed)
+        rows = np.arange(len(index))
+        if len(rows) > sample:
+            rows = np.sort(rng.choice(rows, sample, replace=False))
+        X = np.asarray(index.vectors[rows], dtype=np.float32)
+        clusters = cls()
+        pca = PCA(min(n_components, *X.shape), svd_solver='randomized',
+                  random_state=seed).fit(X)
+        clusters.mean = pca.mean_.astype(np.float32)
+        clusters.components = pca.components_.astype(np.float32)
+        kmeans = MiniBatchKMeans(min(n_clusters, len(X)), batch_size=4096,
+                                 n_init=3, random_state=seed)
+        kmeans.fit(clusters.transform(X))
+        clusters.centroids = kmeans.cluster_centers_.astype(np.float32)
+        clusters.labels = clusters.predict(index.vectors)
+        logger.info(f'Clustered {len(index)} recipes into '
+                    f'{clusters.n_clusters} clusters in '
+                    f'{time.perf_counter() - start:.1f}s')
+        return clusters
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """Projects vectors onto the PCA components"""
+        return (np.asarray(vectors, dtype=np.float32) - self.mean) \
+            @ self.components.T
+
+    def predict(self, vectors: np.ndarray, chunk_size=65536) -> np.ndarray:
+        """Nearest centroid of every vector, a chunk of rows at a time"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        for start in range(0, len(vectors), chunk_size):
+            reduced = self.transform(vectors[start:start + chunk_size])
+            labels[start:start + len(reduced)] = np.argmin(
+                centroid_norms - 2 * reduced @ self.centroids.T, axis=1)
+        return labels
+
+    def update(self, index: RecipeIndex) -> int:
+        """Labels the index rows appended since the last fit or update.
+        Returns how many were labelled."""
+        new = index.vectors[len(self):]
+        if len(new):
+            self.labels = np.concatenate([self.labels, self.predict(new)])
+        return len(new)
+
+    def distances(self, rows: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        """Squared distance in the projected space between vectors and the
+        centroid of their index rows"""
+        offsets = self.transform(vectors) - self.centroids[self.labels[rows]]
+        return np.einsum('ij,ij->i', offsets, offsets)
+
+
+def update_clusters(index: RecipeIndex, n_clusters=256, n_components=64,
+                    refit=False) -> RecipeClusters:
+    """Loads the clusters saved with an index, fitting them when there are
+    none (or refit is set) and labelling rows added since otherwise. Saved
+    back when the index lives on disk."""
+    path = None if index.path is None else index.path / CLUSTERS_DIR
+    clusters = RecipeClusters(path)
+    if refit or clusters.n_clusters == 0 or len(clusters) > len(index) \
+            or len(clusters.mean) != index.dim:
+        clusters = RecipeClusters.fit(index, n_clusters, n_components)
+    elif not clusters.update(index):
+        return clusters
+    if path is not None:
+        clusters.save(path)
+    return clusters
@@ -0,0 +1,120 @@
+import json
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+from loguru import logger
+
+from vector_format import decode_vectors
+
+INDEX_PATH = Path.home() / '.cache' / 'localvore' / 'index'
+
+
+class RecipeIndex:
+    """
+    Persistent, memory-mapped store of the vectors of one collection.
+
+    The index is a directory of append-only files:
+        - vectors.f32: row-major float32 matrix, memory-mapped on load
+        - keys.jsonl: one [_id, title] pair per row
+        - meta.json: vector dimension and row count
+
+    Menus and clusters read their rows from it instead of decoding vectors
+    out of Mongo, and restrict them to a seasonal subset with mask(). New
+    recipes are appended with add() without rewriting existing rows.
+    """
+    def __init__(self, path: Path = None):
+        self.path = None if path is None else Path(path)
+        self.dim, self.ids, self.titles = 0, np.empty(0, dtype=object), []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        if self.path is not None and (self.path / 'meta.json').exists():
+            self._load()
+
+    @classmethod
+    def from_collection(cls, collection) -> 'RecipeIndex':
+        """In-memory index built from a projection-only query, for
+        collections that have no index on disk"""
+        recipes = list(collection.find({'vector': {'$exists': True}},
+                                       {'title': 1, 'vector': 1}))
+        index = cls()
+        index.ids = np.array([str(recipe['_id']) for recipe in recipes],
+                             dtype=object)
+        index.titles = [recipe.get('title', '') for recipe in recipes]
+        index.vectors = decode_vectors([recipe['vector']
+                                        for recipe in recipes])
+        index.dim = index.vectors.shape[1]
+        return index
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + self.ids.nbytes
+
+    def _load(self):
+        meta = json.loads((self.path / 'meta.json').read_text())
+        self.dim, count = meta['dim'], meta['count']
+        keys = [json.loads(line) for line in
+                (self.path / 'keys.jsonl').read_text().splitlines()[:count]]
+        self.ids = np.array([key[0] for key in keys], dtype=object)
+        self.titles = [key[1] for key in keys]
+        if count:
+            self.vectors = np.memmap(self.path / 'vectors.f32',
+                                     dtype=np.float32, mode='r',
+                                     shape=(count, self.dim))
+
+    def add(self, ids: List[str], titles: List[str], vectors: np.ndarray):
+        """Appends rows to the index files and reloads the memory map"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(ids):
+            return
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(f'Expected {self.dim} dimensional vectors, '
+                             f'got {vectors.shape[1]}')
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / 'vectors.f32', 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self.path / 'keys.jsonl', 'a') as f:
+            f.writelines(json.dumps([str(_id), title]) + '\n'
+                         for _id, title in zip(ids, titles))
+        # meta.json is written last, so an interrupted append is ignored
+        (self.path / 'meta.json').write_text(json.dumps(
+            {'dim': vectors.shape[1], 'count': len(self) + len(ids)}))
+        self._load()
+
+    def mask(self, ids: Iterable) -> np.ndarray:
+        """Boolean row mask selecting the given recipe ids"""
+        return np.isin(self.ids, np.array([str(_id) for _id in ids],
+                                          dtype=object))
+
+
+def index_count(path: Path) -> int:
+    """Rows in the index at path, without loading it. 0 if there is none."""
+    meta = Path(path) / 'meta.json'
+    return json.loads(meta.read_text())['count'] if meta.exists() else 0
+
+
+def update_index(collection, path=INDEX_PATH, batch_size=1000) -> RecipeIndex:
+    """Appends vectorized recipes of a Mongo collection that are not yet in
+    its index. Only _ids are scanned; vectors are fetched for new recipes.
+
+    Rows already in the index are never rewritten, since the ingredient
+    index and cluster labels built on it are keyed by row. A recipe whose
+    vector is recomputed in Mongo keeps its old row until the index
+    directory is deleted and rebuilt."""
+    index = RecipeIndex(Path(path) / collection.name)
+    known = set(index.ids)
+    new_ids = [recipe['_id'] for recipe in
+               collection.find({'vector': {'$exists': True}}, {'_id': 1})
+               if str(recipe['_id']) not in known]
+    for start in range(0, len(new_ids), batch_size):
+        batch = list(collection.find(
+            {'_id': {'$in': new_ids[start:start + batch_size]}},
+            {'title': 1, 'vector': 1}))
+        index.add([recipe['_id'] for recipe in batch],
+                  [recipe.get('title', '') for recipe in batch],
+                  decode_vectors([recipe['vector'] for recipe in batch]))
+    logger.info(f'Added {len(new_ids)} recipes to the {collection.name} '
+                f'index ({len(index)} total)')
+    return index
@@ -0,0 +1,84 @@
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+
+import click
+from loguru import logger
+from pymongo import MongoClient, ReplaceOne
+from tqdm import tqdm
+
+from normalize import strip_details
+from parsing import SITE_TAGS, RecipeExtractor
+
+MONGOPATH = 'mongodb://localhost:27017/'
+
+logger.add(sys.stderr)
+
+
+class CorpusExtractor:
+    """Turns one saved html file into a recipe document. A module level
+    class rather than a closure so it can be sent to pool workers."""
+    def __init__(self, tags: Dict, parser='lxml'):
+        self.extractor = RecipeExtractor(tags, parser)
+
+    def __call__(self, path: Path) -> Optional[Dict]:
+        post = self.extractor(path.read_bytes())
+        if post is None or 'ingredients' not in post:
+            return None
+        post.pop('full_recipe')
+        post['_id'] = path.stem
+        post.setdefault('title', path.stem.replace('-', ' ').title())
+        post['raw_ingredients'] = post['ingredients']
+        post['ingredients'] = strip_details(post['ingredients'])
+        post['source'] = path.name
+        return post
+
+
+def reextract(corpus: Path, collection, tags: Dict, workers=None,
+              batch_size=500, parser='lxml') -> int:
+    """Extracts every html file of a saved corpus in a process pool and
+    upserts the recipes into collection, one bulk_write per batch. Keyed on
+    the file name, so replaying the corpus replaces documents in place."""
+    paths = sorted(Path(corpus).glob('*.html'))
+    extract = CorpusExtractor(tags, parser)
+    start = time.perf_counter()
+    written, batch = 0, list()
+    with ProcessPoolExecutor(workers) as pool:
+        for post in tqdm(pool.map(extract, paths, chunksize=16),
+                         total=len(paths), unit=' pages'):
+            if post is not None:
+                batch.append(ReplaceOne({'_id': post['_id']}, post,
+                                        upsert=True))
+            if len(batch) >= batch_size:
+                collection.bulk_write(batch, ordered=False)
+                written, batch = written + len(batch), list()
+        if batch:
+            collection.bulk_write(batch, ordered=False)
+            written += len(batch)
+    elapsed = time.perf_counter() - start
+    logger.info(f'Loaded {written} of {len(paths)} pages into '
+                f'{collection.name} in {elapsed:.1f}s')
+    return written
+
+
+@click.command()
+@click.option('--corpus', default='ella', help='Folder of saved recipe html')
+@click.option('--site', default='ella', type=click.Choice(list(SITE_TAGS)),
+              help='Which scraper tags the corpus was saved with')
+@click.option('--collection', default=None,
+              help='Target collection, defaults to the site name')
+@click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--workers', default=None, type=int,
+              help='Extraction processes, defaults to one per core')
+@click.option('--parser', default='lxml', help='lxml or bs4')
+def main(corpus, site, collection, mongopath, workers, parser):
+    """Replays a saved html corpus into MongoDB without re-scraping. Run the
+    ETL with --collection afterwards to vectorize and index it."""
+    col = MongoClient(mongopath).RECIPES[collection or site]
+    reextract(Path(corpus), col, SITE_TAGS[site], workers, parser=parser)
+
+
+if __name__ == '__main__':
+    main()
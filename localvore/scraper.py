@@ -1,33 +1,35 @@
 import asyncio
-import re
 import sys
-from datetime import date
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
-from aiohttp import ClientSession
+import click
 from bs4 import BeautifulSoup
 from loguru import logger
-from pymongo import MongoClient
-from requests_html import AsyncHTMLSession, HTMLSession
 from tqdm import tqdm
 
-MONGOPATH = 'mongodb://localhost:27017/'
+from crawler import Crawler
+from discovery import discover_bb_recipes
+from manifest import CrawlManifest
+from normalize import strip_details
+from parsing import SITE_TAGS, RecipeExtractor
+from seasonal import get_date
+from tracing import span
 
 
-def get_date() -> str:
-    """Gets date in format compatible with seasonalfoodguide urls,
-    i.e. early-january, late-may, etc."""
-    month = date.today().strftime('%B').lower()
-    period = 'early' if date.today().day <= 15 else 'late'
-    return f'{period}-{month}'
-
-
-def get_seasonal_veggies(state: str) -> List[str]:
+@span('scrape_seasonal')
+def get_seasonal_veggies(state: str, period: str = None,
+                         session=None) -> List[str]:
     """TODO: State should be extracted from Google location services
+
+    Renders the page in Chromium, so this belongs in the seasonal refresh
+    job only. Passing one session for many states reuses its browser.
     """
-    today = get_date()
-    session = HTMLSession()
+    # requests_html drives pyppeteer, so it is only imported when rendering
+    from requests_html import HTMLSession
+    today = period or get_date()
+    session = session or HTMLSession()
     r = session.get(f'http://www.seasonalfoodguide.org/{state}/{today}')
     r.html.render(wait=1, sleep=1)
     veggies = [card.text.lower().split('\n')[0]
@@ -39,31 +41,25 @@ def get_seasonal_veggies(state: str) -> List[str]:
     return veggies
 
 
-def get_all_bb_recipes() -> List[str]:
-    """Scraper that finds all recipe titles on BudgetBytes. More precise than
-    doing 'find all links', as unique recipe URLs are of format url/recipe-title
+def get_all_bb_recipes(**crawl_settings) -> List[str]:
+    """Finds all recipe titles on BudgetBytes. More precise than doing 'find
+    all links', as unique recipe URLs are of format url/recipe-title
+
+    No browser involved: titles come from the WP REST API, or from the
+    unrendered listing pages, see discovery.discover_bb_recipes. Iterate that
+    directly to stream (title, url) pairs as they arrive.
     """
-    recipe_list = list()
-    i = 1
-    while True:
-        sess = HTMLSession()
-        r = sess.get(f'http://www.budgetbytes.com/category/recipes/page/{i}')
-        if r.status_code == 404:
-            break
-        r.html.render(wait=1, sleep=1)
-        for recipe in r.html.find('h4.title'):
-            recipe_list.append(recipe.text)
-        print(f'Processed page {i}')
-        sess.close()
-        i += 1
-    return recipe_list
+    async def collect():
+        return [title async for title, _ in
+                discover_bb_recipes(**crawl_settings)]
+    return asyncio.run(collect())
 
 
 class RecipeScraper:
     """
-    Takes in a list of HTML tags for an arbitrary website, and either
-    scrapes them to save to a MongoDB collection or dump into a text
-    file.
+    Takes in a list of HTML tags for an arbitrary website, and scrapes
+    its recipe pages into a folder of html files named after the
+    collection.
     
     Required Tags:
         - root_url: base url of the view all recipes function of the website
@@ -75,89 +71,124 @@ class RecipeScraper:
         - cost, rating, keywords, category, cuisine. 
         Should all be self-explanatory
     """
-    def __init__(self, tags: Dict[str, str], collection_name: str, save=True, mongo_path=MONGOPATH):
+    def __init__(self, tags: Dict[str, str], collection_name: str, save=True,
+                 incremental=True, parser='lxml', parse_workers=None,
+                 **crawl_settings):
+        """crawl_settings are passed on to the Crawler, e.g. workers,
+        per_host, rate or retries, to tune throughput per site. Recipe
+        pages are parsed by the given parser backend in a pool of
+        parse_workers processes (one per core by default), so parsing never
+        blocks the event loop.
+
+        With incremental, pages are tracked in a crawl manifest next to the
+        output folder: re-crawls send conditional GETs, only parse new or
+        changed pages, and stop paging through listings at the first page
+        that links to nothing new."""
         self.tags = tags
         self.col_name = collection_name
         self.save = save
-        self.mongo_path = mongo_path
+        self.incremental = incremental
+        self.crawl_settings = crawl_settings
+        self.extractor = RecipeExtractor(tags, parser)
+        self.parse_workers = parse_workers
         logger.add(sys.stderr)
 
-    async def get_page_content(self, url):
-        recipe_list = []
-        async with ClientSession() as sess:
-            async with sess.get(url) as r:
-                html = await r.read()
-                print(f"Got recipes from {url.split('/')[-1]}")
-                soup = BeautifulSoup(html)
-                for recipe in soup.find_all('a', 'entry-title-link'):
-                    recipe_list.append(recipe.get('href'))
-        return recipe_list
-
-    async def get_recipes(self, page_url):
-        async with ClientSession() as sess:
-            async with sess.get(page_url) as r:
-                html = await r.read()
-                post = self.make_post(html)
+    def manifest(self) -> Optional[CrawlManifest]:
+        if not self.incremental:
+            return None
+        return CrawlManifest(Path.cwd() / f'{self.col_name}_manifest.sqlite')
+
+    async def _fetch(self, url, crawler: Crawler = None):
+        if crawler is not None:
+            return await crawler.fetch(url)
+        async with Crawler(**self.crawl_settings) as crawler:
+            return await crawler.fetch(url)
+
+    def listing_urls(self) -> List[str]:
+        return [f"{self.tags['root_url']}/recipes/page/{i}" for i in
+                range(1, self.tags['pagination']+1)]
+
+    @staticmethod
+    def recipe_links(html) -> List[str]:
+        soup = BeautifulSoup(html)
+        return [recipe.get('href')
+                for recipe in soup.find_all('a', 'entry-title-link')]
+
+    async def get_page_content(self, url, crawler: Crawler = None):
+        html = await self._fetch(url, crawler)
+        if html is None:
+            return []
+        logger.info(f"Got recipes from {url.split('/')[-1]}")
+        return self.recipe_links(html)
+
+    def write(self, post):
+        title = post.get('title') or post['url'].rstrip('/').split('/')[-1]
+        logger.info(f"Got recipe for {title}")
+        if self.save:
+            self.save_to_disk(title, post)
+
+    async def get_recipes(self, page_url, crawler: Crawler = None):
+        html = await self._fetch(page_url, crawler)
+        post = None if html is None else self.make_post(html)
+        if post is not None:
+            post['url'] = page_url
+            self.write(post)
+
+    async def crawl(self, listing_urls: List[str], follow=False):
+        """Crawls listing pages and every recipe linked from them through
+        one shared Crawler. Listing pages yield links, recipe pages yield
+        posts that are handed to write. With follow, only the first listing
+        page is requested up front, and each listing page queues the next
+        one only if it linked to a recipe missing from the manifest."""
+        listings = list(listing_urls)
+        manifest = self.manifest()
+        # The first crawl has nothing to compare against, so it fans out
+        follow = follow and manifest is not None and len(manifest) > 0
+
+        async def parse(url, html):
+            if url not in listings:
+                post = await loop.run_in_executor(pool, self.extractor, html)
                 if post is not None:
-                    print(f"Got recipe for {post['title']}")
-                    if self.save:
-                        self.save_to_disk(post['title'], post)
+                    post['url'] = url
+                return [], post
+            links = self.recipe_links(html)
+            position = listings.index(url)
+            if (follow and position + 1 < len(listings)
+                    and any(link not in manifest for link in links)):
+                links.append(listings[position + 1])
+            return links, None
+
+        seeds = listings[:1] if follow else listings
+        loop = asyncio.get_event_loop()
+        with ProcessPoolExecutor(self.parse_workers) as pool:
+            async with Crawler(manifest=manifest,
+                               **self.crawl_settings) as crawler:
+                await crawler.crawl(seeds, parse, self.write)
+                logger.info(f'Crawl finished: {crawler.stats}')
+        if manifest is not None:
+            manifest.close()
 
     async def bulk_write(self, base_url):
-        """Scrapes all recipes extracted from budget bytes, writes ingredients
-        to new MongoDB collection"""
-        content = await self.get_page_content(base_url) 
-        task_list = [asyncio.create_task(self.get_recipes(recipe)) for recipe in content]
-        sem = asyncio.Semaphore(10)
-        async with sem:
-            await asyncio.gather(*task_list)
+        """Scrapes all recipes linked from one listing page"""
+        await self.crawl([base_url])
 
     async def _main(self):
-        urls = [f"{self.tags['root_url']}/recipes/page/{i}" for i in
-                     range(1, self.tags['pagination']+1)]
-        sem = asyncio.Semaphore(10)
-        task_list = [asyncio.create_task(self.bulk_write(url)) for url in urls]
-        async with sem:
-            await asyncio.gather(*task_list)
+        await self.crawl(self.listing_urls(), follow=self.incremental)
+
+    strip_details = staticmethod(strip_details)
 
-    @staticmethod
-    def strip_details(ingredients: List[str]):
-        """Removes everything in parentheses and after a comma in every string"""
-        no_parentheses = [re.sub(r'\([^()]*\)', '', string)
-                          for string in ingredients]
-        precomma = [re.findall(r'[^,]+', string)[0] for string in no_parentheses]
-        return precomma
-    
     def make_post(self, r):
-        """"Uses currently open Response object to test for existence of various CSS
-        tags. Returns dictionary for insertion into MongoDB, or None if the
-        ingredients field is blank."""
-        post = dict()
-        soup = BeautifulSoup(r)
-        for key, val in zip(list(self.tags.keys())[3:],
-                            list(self.tags.values())[3:]):
-            try:
-                post[key] = soup.find(val.split('.')).string
-            except AttributeError:
-                pass
-        raw_ingredients = soup.find(self.tags['full_recipe'].split('.'))
-        if len(raw_ingredients) == 0:
-            return None
-        else:
-            post['ingredients'] = raw_ingredients
-            try:
-                post['keywords'] = post['keywords'].split(',')
-            except Exception as e:
-                logger.catch(e)
-                pass
-            return post
+        """"Parses the HTML of a recipe page for the CSS tags of the scraper.
+        Returns dictionary for insertion into MongoDB, or None if the
+        full recipe is missing. See parsing.RecipeExtractor."""
+        return self.extractor(r)
 
     def save_to_disk(self, recipe_title, post):
         Path(Path.cwd() / self.col_name).mkdir(parents=True,
                                                       exist_ok=True)
         path = Path(Path.cwd() / self.col_name)
         output = path / f"{recipe_title.lower().replace(' ', '-')}.html"
-        output.write_text(post['ingredients'].decode())
+        output.write_text(post['full_recipe'])
 
     def scrape(self):
         loop = asyncio.get_event_loop()
@@ -165,17 +196,19 @@ class RecipeScraper:
         loop.close()
 
 
-ella_tags = {
-    'root_url': 'https://naturallyella.com',
-    'pagination': 46,
-    'nav_title': 'h2.entry-title',
-    'title': 'h1.entry-title',
-    'category': 'span.tasty-recipes-category',
-    'full_recipe': 'div.tasty-recipes-entry-content',
-    'ingredients': 'div.tasty-recipes-ingredients',
-    'instructions': 'div.tasty-recipes-instructions',
-    'notes':  'div.tasty-recipes-notes',
-    'keywords': 'em'
-}
-
-RecipeScraper(ella_tags, 'ella').scrape()
+@click.command()
+@click.option('--site', default='ella', type=click.Choice(list(SITE_TAGS)),
+              help='Site to scrape')
+@click.option('--collection', default=None,
+              help='Output folder, defaults to the site name')
+@click.option('--full', is_flag=True,
+              help='Re-crawl every listing page instead of stopping at '
+                   'known recipes')
+def main(site, collection, full):
+    """Scrapes a recipe site into its html folder"""
+    RecipeScraper(SITE_TAGS[site], collection or site,
+                  incremental=not full).scrape()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import sys
+from datetime import date, datetime
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+import click
+from loguru import logger
+from pymongo import DESCENDING, MongoClient
+
+MONGOPATH = 'mongodb://localhost:27017/'
+
+# State slugs as used in seasonalfoodguide urls
+STATES = [
+    'alabama', 'alaska', 'arizona', 'arkansas', 'california', 'colorado',
+    'connecticut', 'delaware', 'florida', 'georgia', 'hawaii', 'idaho',
+    'illinois', 'indiana', 'iowa', 'kansas', 'kentucky', 'louisiana',
+    'maine', 'maryland', 'massachusetts', 'michigan', 'minnesota',
+    'mississippi', 'missouri', 'montana', 'nebraska', 'nevada',
+    'new-hampshire', 'new-jersey', 'new-mexico', 'new-york',
+    'north-carolina', 'north-dakota', 'ohio', 'oklahoma', 'oregon',
+    'pennsylvania', 'rhode-island', 'south-carolina', 'south-dakota',
+    'tennessee', 'texas', 'utah', 'vermont', 'virginia', 'washington',
+    'west-virginia', 'wisconsin', 'wyoming'
+]
+
+logger.add(sys.stderr)
+
+
+def get_date(today: date = None) -> str:
+    """Gets date in format compatible with seasonalfoodguide urls,
+    i.e. early-january, late-may, etc."""
+    today = today or date.today()
+    month = today.strftime('%B').lower()
+    period = 'early' if today.day <= 15 else 'late'
+    return f'{period}-{month}'
+
+
+class SeasonalStore:
+    """
+    Seasonal produce per (state, period), persisted in the RECIPES.seasonal
+    collection and served from memory.
+
+    Lookups never scrape. They are filled by refresh(), which is meant to run
+    as a scheduled job (see the command line entry point below). When the
+    current period has not been stored for a state, e.g. because its scrape
+    failed, the most recently stored period is served instead, read from
+    Mongo on every lookup until the current one is stored.
+    """
+    def __init__(self, mongo_path=MONGOPATH, collection='seasonal'):
+        self.collection = MongoClient(mongo_path).RECIPES[collection]
+        self._memory: Dict[Tuple[str, str], List[str]] = dict()
+        self._lock = Lock()
+
+    def get(self, state: str, period: str = None) -> List[str]:
+        period = period or get_date()
+        key = (state, period)
+        if key in self._memory:
+            return self._memory[key]
+        doc = self.collection.find_one({'_id': f'{state}:{period}'})
+        if doc is None:
+            doc = self.collection.find_one({'state': state},
+                                           sort=[('updated', DESCENDING)])
+            if doc is None:
+                raise KeyError(f'No seasonal produce stored for {state}. '
+                               f'Run seasonal.py to refresh it.')
+            logger.warning(f'No produce for {state} in {period}, serving '
+                           f'{doc["period"]} instead')
+            # Not memoized, so the period is served as soon as the refresh
+            # job of another process stores it
+            return doc['veggies']
+        with self._lock:
+            self._memory[key] = doc['veggies']
+        return doc['veggies']
+
+    def put(self, state: str, period: str, veggies: List[str]):
+        self.collection.replace_one(
+            {'_id': f'{state}:{period}'},
+            {'state': state, 'period': period, 'veggies': veggies,
+             'updated': datetime.utcnow()},
+            upsert=True)
+        with self._lock:
+            self._memory = {key: value for key, value in self._memory.items()
+                            if key[0] != state}
+            self._memory[(state, period)] = veggies
+
+    def refresh(self, states: Iterable[str] = STATES, period: str = None,
+                scrape=None) -> int:
+        """Scrapes every state for the period and stores the results. A
+        failed state keeps its previously stored period. Returns the number
+        of states refreshed."""
+        period = period or get_date()
+        if scrape is None:
+            # Only the refresh job needs the browser stack
+            from requests_html import HTMLSession
+            from scraper import get_seasonal_veggies
+            session = HTMLSession()
+
+            def scrape(state, period):
+                return get_seasonal_veggies(state, period, session)
+        refreshed = 0
+        for state in states:
+            try:
+                self.put(state, period, scrape(state, period))
+                refreshed += 1
+            except Exception as e:
+                logger.warning(f'Could not refresh {state} for {period}: {e}')
+        logger.info(f'Refreshed {refreshed} states for {period}')
+        return refreshed
+
+
+@click.command()
+@click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--state', 'states', multiple=True, default=STATES,
+              help='State to refresh, may be repeated. Defaults to all')
+@click.option('--menus', 'collections', multiple=True,
+              help='Recompute the stored menus drawn from this recipe '
+                   'collection afterwards, may be repeated')
+def main(mongopath, states, collections):
+    """Refreshes the seasonal produce of every state. Meant to be run by cron
+    at least twice a month, at the start of each period."""
+    SeasonalStore(mongopath).refresh(states)
+    if collections:
+        from menus import MenuStore, materialize
+        materialize(MenuStore(mongopath), states, collections)
+
+
+if __name__ == '__main__':
+    main()
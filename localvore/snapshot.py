@@ -0,0 +1,151 @@
+import json
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+
+import click
+import numpy as np
+from loguru import logger
+from pymongo import MongoClient
+
+from recipe_index import RecipeIndex
+from vector_format import decode_vector, decode_vectors
+
+MONGOPATH = 'mongodb://localhost:27017/'
+SNAPSHOT_PATH = Path.home() / '.cache' / 'localvore' / 'snapshots'
+TEXT_FIELDS = ('title', 'url')
+
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema([('_id', pa.string())]
+                     + [(field, pa.string()) for field in TEXT_FIELDS]
+                     + [('ingredients', pa.list_(pa.string()))])
+
+
+def export_snapshot(collection, path: Path = None,
+                    batch_size=10000) -> Path:
+    """Writes every vectorized recipe of a collection to a snapshot
+    directory, a batch at a time:
+        - vectors.npy: float32 matrix, one row per recipe in _id order
+        - metadata.arrow: _id, title, url and ingredients as an uncompressed
+          Arrow IPC file, row aligned with the matrix
+        - meta.json: row count, dimension and export time
+    The snapshot is built next to path and swapped in when complete, so
+    readers never see a partial one."""
+    import pyarrow as pa
+    path = Path(path or SNAPSHOT_PATH / collection.name)
+    query = {'vector': {'$exists': True}}
+    first = collection.find_one(query, {'vector': 1})
+    if first is None:
+        raise ValueError(f'{collection.name} has no vectors to export')
+    dim = len(decode_vector(first['vector']))
+    count = collection.count_documents(query)
+    partial = path.with_name(path.name + '.partial')
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    start = time.perf_counter()
+    vectors = np.lib.format.open_memmap(partial / 'vectors.npy', mode='w+',
+                                        dtype=np.float32, shape=(count, dim))
+    schema = _schema()
+    cursor = collection.find(query, ('vector', 'ingredients') + TEXT_FIELDS,
+                             no_cursor_timeout=True).sort('_id', 1)
+    rows = 0
+    try:
+        with pa.OSFile(str(partial / 'metadata.arrow'), 'wb') as sink, \
+                pa.ipc.new_file(sink, schema) as writer:
+            while rows < count:
+                # Recipes vectorized after counting are left for next time
+                batch = [recipe for _, recipe in
+                         zip(range(min(batch_size, count - rows)), cursor)]
+                if not batch:
+                    break
+                end = rows + len(batch)
+                vectors[rows:end] = decode_vectors(
+                    [recipe['vector'] for recipe in batch])
+                columns = {'_id': [str(recipe['_id']) for recipe in batch],
+                           'ingredients': [recipe.get('ingredients')
+                                           for recipe in batch]}
+                for field in TEXT_FIELDS:
+                    columns[field] = [recipe.get(field) for recipe in batch]
+                writer.write_table(pa.table(columns, schema=schema))
+                rows = end
+    finally:
+        cursor.close()
+    vectors.flush()
+    del vectors
+    # meta.json is written last; rows may fall short of count if recipes
+    # were deleted during the export
+    (partial / 'meta.json').write_text(json.dumps(
+        {'collection': collection.name, 'count': rows, 'dim': dim,
+         'exported': datetime.utcnow().isoformat()}))
+    shutil.rmtree(path, ignore_errors=True)
+    partial.rename(path)
+    logger.info(f'Exported {rows} recipes of {collection.name} to {path} in '
+                f'{time.perf_counter() - start:.1f}s')
+    return path
+
+
+class Snapshot:
+    """
+    A snapshot written by export_snapshot, memory-mapped without copies:
+    vectors is a read-only np.memmap view of vectors.npy and metadata is an
+    Arrow table whose buffers point into the mapped metadata.arrow file.
+    Pages are only read from disk when touched.
+    """
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        self.path = Path(path)
+        meta = json.loads((self.path / 'meta.json').read_text())
+        self.collection, self.dim = meta['collection'], meta['dim']
+        count = meta['count']
+        self.vectors = np.load(self.path / 'vectors.npy',
+                               mmap_mode='r')[:count]
+        source = pa.memory_map(str(self.path / 'metadata.arrow'))
+        self.metadata = pa.ipc.open_file(source).read_all().slice(0, count)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        return (Path(path) / 'meta.json').exists()
+
+    def to_pandas(self):
+        """Metadata as a DataFrame, with a 'vector' column of row views
+        into the mapped matrix"""
+        df = self.metadata.to_pandas()
+        df['vector'] = list(self.vectors)
+        return df
+
+    def to_index(self) -> RecipeIndex:
+        """An in-memory RecipeIndex over the mapped matrix, for serving
+        without a Mongo scan"""
+        index = RecipeIndex()
+        index.ids = np.array(self.metadata.column('_id').to_pylist(),
+                             dtype=object)
+        index.titles = [title or '' for title in
+                        self.metadata.column('title').to_pylist()]
+        index.vectors, index.dim = self.vectors, self.dim
+        return index
+
+
+@click.command()
+@click.option('--collection', default='recipe1M', help='Collection to export')
+@click.option('--mongopath', default=MONGOPATH, help='MongoDB url')
+@click.option('--path', default=None,
+              help='Snapshot directory, defaults to one per collection '
+                   f'under {SNAPSHOT_PATH}')
+@click.option('--batch-size', default=10000, type=int,
+              help='Recipes read from Mongo per batch')
+def main(collection, mongopath, path, batch_size):
+    """Exports the vectors and metadata of a collection to a snapshot that
+    EDA and the API can memory-map instead of scanning Mongo"""
+    export_snapshot(MongoClient(mongopath).RECIPES[collection], path,
+                    batch_size)
+
+
+if __name__ == '__main__':
+    main()
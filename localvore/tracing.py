@@ -0,0 +1,142 @@
+import functools
+import os
+import time
+from bisect import bisect_left
+from threading import Lock, local
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Upper bounds in seconds, from a cache hit to a Chromium scrape
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC = 'localvore_stage_seconds'
+
+_enabled = os.environ.get('LOCALVORE_TRACING', '') not in ('', '0')
+_histograms: Dict[str, 'Histogram'] = dict()
+_histograms_lock = Lock()
+_request = local()
+
+
+class Histogram:
+    """Durations of one stage, bucketed like a Prometheus histogram"""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect_left(BUCKETS, seconds)] += 1
+            self.sum += seconds
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+def enable(on=True):
+    """Turns span recording on or off for the whole process. Also set by
+    LOCALVORE_TRACING=1 in the environment."""
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def record(stage: str, seconds: float):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+    stages = getattr(_request, 'stages', None)
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+class span:
+    """
+    Times a stage, as a context manager or a decorator:
+
+        with span('backend_query'):
+            ...
+
+        @span('create_samples')
+        def create_samples(...):
+
+    Every duration goes to the stage's histogram and, inside a traced
+    request, to its breakdown. When tracing is disabled a span only checks
+    a flag.
+    """
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            record(self.stage, time.perf_counter() - self.start)
+            self.start = None
+
+    def __call__(self, fn: Callable) -> Callable:
+        stage = self.stage
+
+        @functools.wraps(fn)
+        def traced(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return traced
+
+
+def start_request():
+    """Starts collecting the stage breakdown of the current thread's
+    request"""
+    _request.stages = [] if _enabled else None
+
+
+def finish_request() -> Optional[List[Tuple[str, float]]]:
+    """(stage, seconds) of every span since start_request, or None when
+    tracing is disabled"""
+    stages = getattr(_request, 'stages', None)
+    _request.stages = None
+    return stages
+
+
+def server_timing(stages: List[Tuple[str, float]]) -> str:
+    """A breakdown as a Server-Timing header value, in milliseconds"""
+    return ', '.join(f'{stage};dur={seconds * 1000:.2f}'
+                     for stage, seconds in stages)
+
+
+def render() -> str:
+    """Every stage histogram in the Prometheus text exposition format"""
+    lines = [f'# HELP {METRIC} Time spent in instrumented stages',
+             f'# TYPE {METRIC} histogram']
+    for stage in sorted(_histograms):
+        counts, total = _histograms[stage].snapshot()
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{METRIC}_bucket{{stage="{stage}",le="{le}"}} '
+                         f'{cumulative}')
+        lines.append(f'{METRIC}_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{METRIC}_count{{stage="{stage}"}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
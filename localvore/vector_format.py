@@ -0,0 +1,56 @@
+import pickle
+import struct
+from typing import Sequence
+
+import numpy as np
+from bson.binary import Binary
+
+# Versioned vector encoding: a 9 byte header (magic, format version, dtype
+# code, dimension) followed by the raw little-endian float32 values.
+MAGIC = b'LVV'
+VERSION = 1
+DTYPE_CODE = b'f'
+HEADER = struct.Struct('<3sBcI')
+DTYPE = np.dtype('<f4')
+
+
+def encode_vector(vector) -> Binary:
+    """Packs a vector into the compact header + float32 bytes format"""
+    values = np.ascontiguousarray(vector, dtype=DTYPE).ravel()
+    return Binary(HEADER.pack(MAGIC, VERSION, DTYPE_CODE, len(values))
+                  + values.tobytes())
+
+
+def is_encoded(data: bytes) -> bool:
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def decode_vector(data: bytes) -> np.ndarray:
+    """Unpacks a single vector. Documents written before the compact
+    format stored pickled numpy arrays, which are still read."""
+    if not is_encoded(data):
+        return np.asarray(pickle.loads(data), dtype=np.float32)
+    magic, version, code, dim = HEADER.unpack_from(data)
+    if version != VERSION or code != DTYPE_CODE:
+        raise ValueError(f'Unsupported vector format {version}/{code}')
+    return np.frombuffer(data, dtype=DTYPE, count=dim,
+                         offset=HEADER.size).astype(np.float32)
+
+
+def decode_vectors(blobs: Sequence[bytes]) -> np.ndarray:
+    """Decodes many vectors into one (n, dim) float32 matrix. When every
+    blob shares the same header, the blobs are joined and read with a
+    single np.frombuffer over a (header, values) record dtype."""
+    blobs = [bytes(blob) for blob in blobs]
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    header = blobs[0][:HEADER.size]
+    if (is_encoded(header)
+            and all(blob[:HEADER.size] == header for blob in blobs)):
+        dim = HEADER.unpack(header)[3]
+        record = np.dtype([('header', f'V{HEADER.size}'),
+                           ('values', DTYPE, (dim,))])
+        if all(len(blob) == record.itemsize for blob in blobs):
+            joined = np.frombuffer(b''.join(blobs), dtype=record)
+            return joined['values'].astype(np.float32)
+    return np.vstack([decode_vector(blob) for blob in blobs])
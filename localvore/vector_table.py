@@ -0,0 +1,192 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import numpy as np
+from loguru import logger
+
+TABLE_PATH = Path.home() / '.cache' / 'localvore' / 'ingredient_vectors'
+
+
+def load_nlp(model='en_core_web_lg'):
+    """Loads spaCy with every pipe that recipe vectors don't need disabled,
+    since Doc.vector only relies on the tokenizer and static word vectors.
+    spaCy is imported here so table lookups never pay for it."""
+    import spacy
+    return spacy.load(model, disable=['parser', 'ner', 'tagger'])
+
+
+class IngredientVectorTable:
+    """
+    Lookup table from lowercase ingredient string to its spaCy vector.
+
+    A recipe vector is the mean word vector over every token of its joined,
+    lowercased ingredients. Storing each ingredient's mean vector together
+    with its token count means the recipe vector can be rebuilt exactly as a
+    count-weighted mean over table rows, without parsing anything.
+
+    On disk the table is a directory holding vectors.npy (float32, one row
+    per ingredient), counts.npy (tokens per ingredient) and vocab.json (the
+    ingredient strings in row order). Both arrays are memory-mapped on load.
+    Strings missing from the table are vectorized with spaCy and kept in a
+    growing in-memory buffer, so the model is only loaded when the
+    vocabulary grows. The buffer is written out by flush(), once per run
+    when the table is used as a context manager, rather than rewriting the
+    files for every batch with a new ingredient.
+
+    A read_only table never loads spaCy or writes, and raises KeyError for
+    missing strings; it is what concurrent workers open.
+    """
+    def __init__(self, path=TABLE_PATH, nlp=None, model='en_core_web_lg',
+                 n_process=1, read_only=False):
+        self.path = Path(path)
+        self.model = model
+        self.n_process = n_process
+        self.read_only = read_only
+        self._nlp = nlp
+        self.index: Dict[str, int] = dict()
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.counts = np.empty(0, dtype=np.int32)
+        # Rows added since the last flush, with spare capacity
+        self._new_vectors = np.empty((0, 0), dtype=np.float32)
+        self._new_counts = np.empty(0, dtype=np.int32)
+        if (self.path / 'vocab.json').exists():
+            self._load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dim(self) -> int:
+        return max(self.vectors.shape[1], self._new_vectors.shape[1])
+
+    @property
+    def pending(self) -> int:
+        """Rows added since the last flush"""
+        return len(self.index) - len(self.counts)
+
+    def __contains__(self, ingredient):
+        return ingredient.lower() in self.index
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            logger.info(f'Loading {self.model} for out of vocabulary '
+                        f'ingredients')
+            self._nlp = load_nlp(self.model)
+        return self._nlp
+
+    def _load(self):
+        vocab = json.loads((self.path / 'vocab.json').read_text())
+        self.index = {ingredient: i for i, ingredient in enumerate(vocab)}
+        self.vectors = np.load(self.path / 'vectors.npy', mmap_mode='r')
+        self.counts = np.load(self.path / 'counts.npy', mmap_mode='r')
+
+    def flush(self):
+        """Writes the rows added since the last flush, if there are any"""
+        pending = self.pending
+        if not pending:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        vocab = sorted(self.index, key=self.index.get)
+        for name, saved, new in (
+                ('vectors', self.vectors, self._new_vectors),
+                ('counts', self.counts, self._new_counts)):
+            array = new[:pending]
+            if len(saved):
+                array = np.concatenate([saved, array])
+            partial = self.path / f'{name}.part.npy'
+            np.save(partial, array)
+            partial.replace(self.path / f'{name}.npy')
+        (self.path / 'vocab.json').write_text(json.dumps(vocab))
+        self._new_vectors = np.empty((0, 0), dtype=np.float32)
+        self._new_counts = np.empty(0, dtype=np.int32)
+        self._load()
+        logger.info(f'Saved {pending} new ingredients to vector table '
+                    f'({len(self)} total)')
+
+    def _append(self, vectors: np.ndarray, counts: np.ndarray):
+        """Appends rows to the buffer, doubling its capacity when full"""
+        start, end = self.pending, self.pending + len(counts)
+        if end > len(self._new_counts):
+            capacity = max(end, 2 * len(self._new_counts))
+            grown = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            if start:
+                grown[:start] = self._new_vectors[:start]
+            self._new_vectors = grown
+            self._new_counts = np.resize(self._new_counts, capacity)
+        self._new_vectors[start:end] = vectors
+        self._new_counts[start:end] = counts
+
+    def add(self, ingredients: Iterable[str]):
+        """Vectorizes ingredients missing from the table with spaCy and
+        buffers them until the next flush. Returns the number of new
+        entries."""
+        missing = list(dict.fromkeys(
+            item.lower() for item in ingredients
+            if item.lower() not in self.index))
+        if not missing:
+            return 0
+        if self.read_only:
+            raise KeyError(f'{len(missing)} ingredients, e.g. {missing[0]!r}, '
+                           f'are missing from the read-only vector table at '
+                           f'{self.path}')
+        docs = list(self.nlp.pipe(missing, n_process=self.n_process))
+        vectors = np.array([doc.vector for doc in docs], dtype=np.float32)
+        self._append(vectors.reshape(len(docs), -1),
+                     np.array([len(doc) for doc in docs], dtype=np.int32))
+        start = len(self.index)
+        self.index.update((item, start + i) for i, item in enumerate(missing))
+        logger.info(f'Added {len(missing)} ingredients to vector table '
+                    f'({len(self)} total)')
+        return len(missing)
+
+    def _rows(self, ids: np.ndarray):
+        """Vectors and token counts of rows, saved or buffered"""
+        saved = len(self.counts)
+        if not self.pending:
+            return self.vectors[ids], self.counts[ids]
+        vectors = np.empty((len(ids), self.dim), dtype=np.float32)
+        counts = np.empty(len(ids), dtype=np.int32)
+        old = ids < saved
+        if old.any():
+            vectors[old] = self.vectors[ids[old]]
+            counts[old] = self.counts[ids[old]]
+        new = ids[~old] - saved
+        vectors[~old] = self._new_vectors[new]
+        counts[~old] = self._new_counts[new]
+        return vectors, counts
+
+    def ids(self, ingredients: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.index[item.lower()] for item in ingredients),
+                           dtype=np.int64)
+
+    def recipe_vectors(self, recipes: List[List[str]]) -> np.ndarray:
+        """Vectors for a batch of ingredient lists, as one float32 matrix.
+        Rows are gathered by id and reduced per recipe with a weighted sum,
+        so the only Python-level work is the dictionary lookup."""
+        self.add(item for ingredients in recipes for item in ingredients)
+        lengths = np.array([len(ingredients) for ingredients in recipes])
+        ids = self.ids(item for ingredients in recipes for item in ingredients)
+        dim = self.dim if len(self.index) else 0
+        result = np.zeros((len(recipes), dim), dtype=np.float32)
+        if len(ids) == 0:
+            return result
+        vectors, counts = self._rows(ids)
+        counts = counts.astype(np.float32)
+        weighted = vectors * counts[:, None]
+        filled = lengths > 0
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[filled]
+        tokens = np.add.reduceat(counts, starts)
+        sums = np.add.reduceat(weighted, starts, axis=0)
+        result[filled] = sums / np.maximum(tokens, 1)[:, None]
+        return result
+
+    def recipe_vector(self, ingredients: List[str]) -> np.ndarray:
+        return self.recipe_vectors([ingredients])[0]
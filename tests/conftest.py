@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# Modules inside localvore/ import each other as top level modules, the way
+# they are run with `flask run` or `python ETL_pipeline.py` from that folder.
+sys.path.insert(0, str(Path(__file__).parents[1] / 'localvore'))
@@ -0,0 +1,38 @@
+import time
+
+import numpy as np
+
+from localvore.cache import TTLCache
+
+
+def test_hits_and_misses():
+    cache = TTLCache(max_bytes=1000)
+    assert cache.get('a') is None
+    cache.set('a', np.zeros(10, dtype=np.uint8))
+    assert cache.get('a') is not None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_lru_eviction_by_bytes():
+    cache = TTLCache(max_bytes=250)
+    for key in 'abc':
+        cache.set(key, np.zeros(100, dtype=np.uint8))
+    assert 'a' not in cache and 'c' in cache
+    cache.get('b')
+    cache.set('d', np.zeros(100, dtype=np.uint8))
+    assert 'b' in cache and 'c' not in cache
+    assert cache.nbytes == 200 and cache.evictions == 2
+
+
+def test_ttl_expiry():
+    cache = TTLCache(max_bytes=1000, ttl=0.01)
+    cache.set('a', 1, size=1)
+    time.sleep(0.02)
+    assert cache.get_or_load('a', lambda: 2) == 2
+    assert cache.get('a') == 2
+
+
+def test_oversized_values_are_not_cached():
+    cache = TTLCache(max_bytes=10)
+    cache.set('a', np.zeros(100, dtype=np.uint8))
+    assert len(cache) == 0
@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pytest
+
+from localvore import clustering
+from localvore.recipe_index import RecipeIndex
+
+
+@pytest.fixture
+def collection():
+    """An in-memory BB index of 8 tight blobs whose recipes use up to 3
+    seasonal ingredients, registered in the clustering caches"""
+    rng = np.random.RandomState(0)
+    n, dim = 800, 32
+    truth = np.arange(n) % 8
+    index = RecipeIndex()
+    index.vectors = (rng.rand(8, dim)[truth] * 10 +
+                     rng.normal(scale=0.05, size=(n, dim))).astype(np.float32)
+    index.dim = dim
+    index.ids = np.array([str(i) for i in range(n)], dtype=object)
+    index.titles = [f'blob{label} recipe{i}' for i, label in enumerate(truth)]
+    coverage = rng.randint(0, 4, n).astype(np.int32)
+    clustering.matrices.invalidate()
+    clustering.masks.invalidate()
+    clustering.matrices.set('BB', index, size=1)
+    clustering.masks.set(('BB', n, 'iowa', clustering.get_date()), coverage)
+    clustering.matrices.set(('clusters', 'BB', n),
+                            clustering.update_clusters(index, n_clusters=8,
+                                                       n_components=8))
+    yield index, coverage
+    clustering.matrices.invalidate()
+    clustering.masks.invalidate()
+
+
+def test_menu_spans_clusters(collection):
+    index, coverage = collection
+    menu = clustering.clustering('iowa', ['BB'], n_recipes=5, seed=1)
+    assert len(menu) == 5
+    assert len({name.split()[0] for name in menu}) == 5
+    rows = [index.titles.index(name) for name in menu]
+    assert (coverage[rows] == 3).all()
+
+
+def test_seed_is_reproducible(collection):
+    menus = [clustering.clustering('iowa', ['BB'], seed=7) for _ in range(2)]
+    assert menus[0] == menus[1]
+    unseeded = {tuple(clustering.clustering('iowa', ['BB']))
+                for _ in range(10)}
+    assert len(unseeded) > 1
+
+
+def test_cached_menu_is_fast(collection):
+    clustering.clustering('iowa', ['BB'])
+    start = time.perf_counter()
+    for _ in range(20):
+        clustering.clustering('iowa', ['BB'])
+    assert (time.perf_counter() - start) / 20 < 0.05
+
+
+def test_mmr_prefers_dissimilar_rows():
+    vectors = np.array([[1, 0], [1, 0.01], [0, 1]], dtype=np.float32)
+    relevance = np.array([1.0, 0.99, 0.5])
+    assert clustering.mmr(relevance, vectors, 2, weight=0.5).tolist() == \
+        [0, 2]
+    assert clustering.mmr(relevance, vectors, 2, weight=1).tolist() == [0, 1]
@@ -0,0 +1,82 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from localvore.crawler import Crawler, retry_after
+
+
+def make_app(failures):
+    async def listing(request):
+        links = ''.join(f'<a href="/recipe/{i}">r</a>' for i in range(5))
+        return web.Response(text=links)
+
+    async def recipe(request):
+        name = request.match_info['name']
+        if failures.get(name, 0) > 0:
+            failures[name] -= 1
+            return web.Response(status=503)
+        if name == '4':
+            return web.Response(status=404)
+        return web.Response(text=f'recipe {name}')
+
+    app = web.Application()
+    app.router.add_get('/listing', listing)
+    app.router.add_get('/recipe/{name}', recipe)
+    return app
+
+
+@pytest.mark.asyncio
+async def test_crawl_follows_links_and_retries():
+    failures = {'1': 2}
+    written = []
+    async with TestServer(make_app(failures)) as server:
+        root = str(server.make_url(''))
+
+        def parse(url, body):
+            if url.endswith('/listing'):
+                return [root + f'/recipe/{i}' for i in range(5)], None
+            return [], body.decode()
+
+        async def write(item):
+            await asyncio.sleep(0.01)
+            written.append(item)
+
+        async with Crawler(workers=3, rate=1000, backoff=0.01,
+                           queue_size=2) as crawler:
+            await crawler.crawl([root + '/listing'], parse, write)
+    assert sorted(written) == [f'recipe {i}' for i in range(4)]
+    assert crawler.stats['retries'] == 2
+
+
+@pytest.mark.asyncio
+async def test_per_host_concurrency_is_bounded():
+    in_flight, peak = 0, 0
+
+    async def slow(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return web.Response(text='ok')
+
+    app = web.Application()
+    app.router.add_get('/{n}', slow)
+    async with TestServer(app) as server:
+        urls = [str(server.make_url(f'/{i}')) for i in range(12)]
+        async with Crawler(workers=10, per_host=2, rate=1000) as crawler:
+            await crawler.crawl(urls, lambda url, body: ([], None), print)
+    assert peak <= 2
+
+
+def test_retry_after_seconds_or_http_date():
+    assert retry_after('2', 1.0) == 2.0
+    assert retry_after(None, 1.0) == 1.0
+    assert retry_after('soon', 1.0) == 1.0
+    later = retry_after(formatdate(time.time() + 30, usegmt=True), 1.0)
+    assert 28 < later <= 30
+    assert retry_after('Wed, 21 Oct 2015 07:28:00 GMT', 1.0) == 0.0
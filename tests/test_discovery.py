@@ -0,0 +1,72 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from localvore.discovery import discover_bb_recipes, find_last_page
+
+PAGES = 23
+PER_PAGE = 3
+
+
+def titles(page):
+    return [f'Recipe {page}-{i}' for i in range(PER_PAGE)]
+
+
+def make_app(rest=True):
+    async def categories(request):
+        return web.json_response([{'id': 7}])
+
+    async def posts(request):
+        page = int(request.query['page'])
+        assert request.query['categories'] == '7'
+        if page > PAGES:
+            return web.json_response({'code': 'invalid_page'}, status=400)
+        body = [{'title': {'rendered': title.replace('-', '&#8211;')},
+                 'link': f'/{title}'} for title in titles(page)]
+        return web.json_response(body,
+                                 headers={'X-WP-TotalPages': str(PAGES)})
+
+    async def listing(request):
+        page = int(request.match_info['page'])
+        if page > PAGES:
+            return web.Response(status=404)
+        cards = ''.join(f'<h4 class="title"><a href="/{title}">{title}</a>'
+                        '</h4>' for title in titles(page))
+        return web.Response(text=f'<html><body>{cards}</body></html>',
+                            content_type='text/html')
+
+    app = web.Application()
+    if rest:
+        app.router.add_get('/wp-json/wp/v2/categories', categories)
+        app.router.add_get('/wp-json/wp/v2/posts', posts)
+    app.router.add_get('/category/recipes/page/{page}', listing)
+    return app
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('last', [0, 1, 2, 5, 64, 65, 1000])
+async def test_find_last_page(last):
+    probed = []
+
+    async def exists(page):
+        probed.append(page)
+        return page <= last
+
+    assert await find_last_page(exists, fanout=4) == last
+    assert len(probed) < 40
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('rest', [True, False])
+async def test_discover_bb_recipes(rest):
+    async with TestServer(make_app(rest)) as server:
+        root = str(server.make_url('')).rstrip('/')
+        found = [post async for post in
+                 discover_bb_recipes(root, rate=1000, backoff=0.01)]
+    expected = [title for page in range(1, PAGES + 1)
+                for title in titles(page)]
+    if rest:
+        expected = [title.replace('-', '–') for title in expected]
+    assert [title for title, _ in found] == expected
+    assert all(url.endswith(title.replace('–', '-'))
+               for title, url in found)
@@ -1,38 +1,19 @@
+import json
+import pickle
 import string
 
+import mongomock
 import numpy as np
+import pandas as pd
+import spacy
+from bson.binary import Binary
 from hypothesis import assume
 from hypothesis import given
 from hypothesis import strategies as st
 from hypothesis.extra.pandas import column, data_frames
 
 from localvore import ETL_pipeline
-
-
-@st.composite
-def same_len_lists(draw):
-    n = draw(st.integers(min_value=3, max_value=12))
-    ingrs = st.lists(st.dictionaries(keys=st.just('text'),
-                                    values=st.text(min_size=3, max_size=12,
-                                    alphabet=string.ascii_lowercase),
-                                    min_size=1, max_size=1),
-                     min_size=n, max_size=n)
-    valid = st.lists(st.booleans(), min_size=n, max_size=n)
-    return draw(ingrs), draw(valid)
-
-
-@given(same_len_lists())
-def test_compression(lists):
-    true_vals = list(filter(lambda val: val is True, lists[1]))
-    if len(true_vals) > 0:
-        assert len(ETL_pipeline._compression(*lists)) == len(true_vals)
-    else:
-        assert np.isnan(ETL_pipeline._compression(*lists))
-
-
-@given(same_len_lists())
-def test_textract(lists):
-    assert type(ETL_pipeline._textract(lists[0])[0]) == str
+from localvore.vector_format import decode_vector, encode_vector
 
 
 @given(
@@ -68,3 +49,84 @@ def test_filter_predictions(mock_df):
     assume(len(df) > 0)
     assert len(df.columns) == 2
     assert len(df['ingredients']) > 0
+
+
+def test_insert_recipes(tmp_path):
+    layer1 = tmp_path / 'layer1.json'
+    layer1.write_text(json.dumps([
+        {'id': 'a', 'title': 'Soup', 'url': 'http://a', 'partition': 'train'},
+        {'id': 'b', 'title': 'Stew'},
+        {'id': 'a', 'title': 'Soup', 'url': 'http://a'},
+        {'id': 'c', 'title': 'Salad', 'url': 'http://c'},
+    ]))
+    col = mongomock.MongoClient().RECIPES.recipe1M
+    inserted = ETL_pipeline.insert_recipes(layer1, col, batch_size=2)
+    assert inserted == 3
+    assert col.find_one({'_id': 'b'}) == {'_id': 'b', 'title': 'Stew'}
+    assert col.find_one({'_id': 'c'})['url'] == 'http://c'
+
+
+def test_filter_predictions_regroups():
+    df = pd.DataFrame({
+        '_id': ['a', 'b', 'c'],
+        'raw_ingrs': [[{'text': 'flour'}, {'text': 'salt'}],
+                      [{'text': 'water'}],
+                      [{'text': 'butter'}, {'text': 'sugar'},
+                       {'text': 'egg'}]],
+        'valid': [[True, False], [False], [True, False, True]],
+    })
+    df = ETL_pipeline.filter_predictions(df)
+    assert df['_id'].tolist() == ['a', 'c']
+    assert df['ingredients'].tolist() == [['flour'], ['butter', 'egg']]
+
+
+def test_filter_predictions_empty_frame():
+    df = pd.DataFrame({'_id': [], 'raw_ingrs': [], 'valid': []})
+    assert ETL_pipeline.filter_predictions(df).empty
+
+
+def test_insert_ingredients():
+    col = mongomock.MongoClient().RECIPES.recipe1M
+    col.insert_many([{'_id': 'a'}, {'_id': 'c'}])
+    df = pd.DataFrame({'_id': ['a', 'c'],
+                       'ingredients': [['flour'], ['butter', 'egg']]})
+    assert ETL_pipeline.insert_ingredients(df, col, chunk_size=1) == 2
+    assert col.find_one({'_id': 'c'})['ingredients'] == ['butter', 'egg']
+
+
+def test_load_predictions(tmp_path):
+    predictions = tmp_path / 'det_ingrs.json'
+    predictions.write_text(json.dumps([
+        {'id': str(i), 'ingredients': [{'text': 'salt'}], 'valid': [True]}
+        for i in range(5)
+    ]))
+    chunks = list(ETL_pipeline.load_predictions(str(predictions),
+                                                chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(chunks[0].columns) == ['_id', 'raw_ingrs', 'valid']
+    assert ETL_pipeline.filter_predictions(chunks[-1])['_id'].tolist() == ['4']
+
+
+def test_ingredient_vectorization(tmp_path):
+    col = mongomock.MongoClient().RECIPES.recipe1M
+    col.insert_many([{'_id': 'a', 'ingredients': ['Flour', 'salt']},
+                     {'_id': 'b', 'ingredients': ['butter']},
+                     {'_id': 'c', 'ingredients': ['egg'], 'vector': b'done'},
+                     {'_id': 'd', 'title': 'no ingredients'}])
+    ETL_pipeline.ingredient_vectorization(col, batch_size=1,
+                                          nlp=spacy.blank('en'),
+                                          table_path=tmp_path)
+    assert col.count_documents({'vector': {'$exists': True}}) == 3
+    assert col.find_one({'_id': 'c'})['vector'] == b'done'
+    assert col.database.checkpoints.count_documents({}) == 0
+
+
+def test_migrate_vectors():
+    col = mongomock.MongoClient().RECIPES.recipe1M
+    vector = np.ones(300, dtype=np.float32)
+    col.insert_many([{'_id': 'a', 'vector': Binary(pickle.dumps(vector))},
+                     {'_id': 'b', 'vector': encode_vector(vector)},
+                     {'_id': 'c'}])
+    assert ETL_pipeline.migrate_vectors(col, batch_size=2) > 0
+    for recipe in col.find({'vector': {'$exists': True}}):
+        np.testing.assert_array_equal(decode_vector(recipe['vector']), vector)
@@ -0,0 +1,164 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import numpy as np
+import pytest
+import spacy
+
+from localvore import etl_runner
+from localvore.recipe_index import RecipeIndex
+from localvore.vector_table import IngredientVectorTable
+
+N = 60
+INGREDIENTS = ['kale', 'salt', 'beet', 'rice', 'egg', 'leek']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(etl_runner, 'MongoClient', lambda path: client)
+    etl_runner._client.cache_clear()
+    return client
+
+
+@pytest.fixture
+def files(tmp_path):
+    layer1 = tmp_path / 'layer1.json'
+    layer1.write_text(json.dumps([{'id': f'{i:04x}', 'title': f'Recipe {i}',
+                                   'url': f'http://x/{i}'}
+                                  for i in range(N)]))
+    predictions = tmp_path / 'det_ingrs.json'
+    predictions.write_text(json.dumps([
+        {'id': f'{i:04x}',
+         'ingredients': [{'text': INGREDIENTS[i % 6]},
+                         {'text': INGREDIENTS[(i + 1) % 6]}],
+         'valid': [True, i % 2 == 0]} for i in range(N)]))
+    return layer1, predictions
+
+
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank('en')
+    rng = np.random.RandomState(0)
+    for word in INGREDIENTS:
+        nlp.vocab.set_vector(word, rng.rand(8).astype(np.float32))
+    return nlp
+
+
+def run(files, tmp_path, nlp, **kwargs):
+    layer1, predictions = files
+    etl_runner.run_pipeline('mongodb://test', 'recipes', layer1, predictions,
+                            shards=4, workers=2, batch_size=7,
+                            table_path=tmp_path / 'table',
+                            index_dir=tmp_path / 'index', nlp=nlp,
+                            executor=ThreadPoolExecutor, **kwargs)
+
+
+def test_sharded_pipeline_builds_everything(client, files, tmp_path, nlp):
+    run(files, tmp_path, nlp)
+    col = client.RECIPES.recipes
+    assert col.count_documents({}) == N
+    assert col.find_one({'_id': '0001'})['ingredients'] == ['salt']
+    assert col.find_one({'_id': '0002'})['ingredients'] == ['beet', 'rice']
+    assert col.count_documents({'vector': {'$exists': True}}) == N
+    assert len(RecipeIndex(tmp_path / 'index' / 'recipes')) == N
+    markers = client.RECIPES.checkpoints
+    assert markers.count_documents({'stage': 'insert'}) == 9
+    assert sum(marker['count'] for marker in
+               markers.find({'stage': 'insert'})) == N
+
+
+def test_resume_skips_finished_shards(client, files, tmp_path, nlp,
+                                      monkeypatch):
+    failing = etl_runner.vectorize_shard
+
+    def vectorize_shard(mongopath, collection, id_range, *args):
+        if id_range[0] is None:
+            raise ConnectionError('worker died')
+        return failing(mongopath, collection, id_range, *args)
+    monkeypatch.setattr(etl_runner, 'vectorize_shard', vectorize_shard)
+    with pytest.raises(RuntimeError, match='rerun with --resume'):
+        run(files, tmp_path, nlp)
+    col = client.RECIPES.recipes
+    assert 0 < col.count_documents({'vector': {'$exists': True}}) < N
+
+    calls = []
+    monkeypatch.setattr(etl_runner, 'insert_batch',
+                        lambda *args: calls.append(args) or 0)
+    monkeypatch.setattr(etl_runner, 'vectorize_shard', failing)
+    run(files, tmp_path, nlp, resume=True)
+    assert calls == []
+    assert col.count_documents({'vector': {'$exists': True}}) == N
+
+
+def test_input_is_parsed_once_and_failed_batches_resume(client, files,
+                                                        tmp_path, nlp,
+                                                        monkeypatch):
+    streams = []
+    stream_recipes = etl_runner.stream_recipes
+    monkeypatch.setattr(etl_runner, 'stream_recipes',
+                        lambda path: streams.append(path) or
+                        stream_recipes(path))
+    inserting = etl_runner.insert_batch
+
+    def insert_batch(mongopath, collection, batch):
+        if batch[0]['_id'] == f'{14:04x}':
+            raise ConnectionError('worker died')
+        return inserting(mongopath, collection, batch)
+    monkeypatch.setattr(etl_runner, 'insert_batch', insert_batch)
+    with pytest.raises(RuntimeError, match=r'parts \[2\]'):
+        run(files, tmp_path, nlp, vectorization=False)
+    assert len(streams) == 1
+    col = client.RECIPES.recipes
+    assert col.count_documents({}) == N - 7
+
+    batches = []
+    monkeypatch.setattr(etl_runner, 'insert_batch',
+                        lambda *args: batches.append(args[-1]) or
+                        inserting(*args))
+    run(files, tmp_path, nlp, vectorization=False, resume=True)
+    assert [batch[0]['_id'] for batch in batches] == [f'{14:04x}']
+    assert col.count_documents({}) == N
+
+
+def test_appended_run_adds_new_ingredients_in_the_parent(client, files,
+                                                         tmp_path, nlp):
+    run(files, tmp_path, nlp)
+    col = client.RECIPES.recipes
+    col.insert_one({'_id': 'ffff', 'ingredients': ['okra']})
+    etl_runner.run_pipeline('mongodb://test', 'recipes', shards=4,
+                            workers=2, table_path=tmp_path / 'table',
+                            index_dir=tmp_path / 'index', nlp=nlp,
+                            executor=ThreadPoolExecutor)
+    assert 'okra' in IngredientVectorTable(tmp_path / 'table')
+    assert 'vector' in col.find_one({'_id': 'ffff'})
+
+
+def test_vectorize_workers_never_write_the_table(client, tmp_path):
+    col = client.RECIPES.recipes
+    col.insert_one({'_id': 'a', 'ingredients': ['okra']})
+    with pytest.raises(KeyError, match='okra'):
+        etl_runner.vectorize_shard('mongodb://test', 'recipes',
+                                   [None, None], tmp_path / 'table')
+    assert not (tmp_path / 'table').exists()
+
+
+def test_vocabulary_is_streamed_in_chunks():
+    col = mongomock.MongoClient().RECIPES.recipes
+    col.insert_many([{'_id': i, 'ingredients': INGREDIENTS[i % 6:]}
+                     for i in range(12)])
+    chunks = list(etl_runner.distinct_ingredients(col, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert sorted(sum(chunks, [])) == sorted(INGREDIENTS)
+
+
+def test_id_ranges_cover_every_id():
+    col = mongomock.MongoClient().RECIPES.recipes
+    col.insert_many([{'_id': f'{i:03d}', 'ingredients': ['a']}
+                     for i in range(10)])
+    ranges = etl_runner.id_ranges(col, 3)
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    assert [upper for _, upper in ranges[:-1]] == \
+        [lower for lower, _ in ranges[1:]]
+    assert len(ranges) == 3
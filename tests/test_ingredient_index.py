@@ -0,0 +1,60 @@
+import mongomock
+import numpy as np
+
+from localvore.ingredient_index import (INGREDIENTS_FILE, InvertedIndex,
+                                        build_ingredient_index,
+                                        normalize_token)
+from localvore.recipe_index import RecipeIndex
+
+recipes = [['Cherry Tomatoes', 'basil'],
+           ['swiss chard', 'garlic'],
+           ['chard', 'tomato', 'potatoes'],
+           ['flour']]
+
+
+def test_normalize_token():
+    assert normalize_token('Tomatoes') == 'tomato'
+    assert normalize_token('berries') == 'berry'
+    assert normalize_token('asparagus') == 'asparagu'
+    assert normalize_token('grass') == 'grass'
+
+
+def test_coverage_ranks_recipes():
+    index = InvertedIndex.build(['a', 'b', 'c', 'd'], recipes)
+    coverage = index.coverage(['tomatoes', 'swiss chard', 'potato'])
+    assert coverage.tolist() == [1, 1, 2, 0]
+
+
+def test_tokens_must_match_within_one_ingredient():
+    index = InvertedIndex.build(['a', 'b', 'c'],
+                                [['green onion', 'black beans'],
+                                 ['sweet corn', 'potato'],
+                                 ['Green Beans', 'sweet potatoes']])
+    assert index.match('green beans').tolist() == [2]
+    assert index.match('sweet potato').tolist() == [2]
+    assert index.coverage(['green beans', 'potato']).tolist() == [0, 1, 2]
+
+
+def test_coverage_aligns_ids():
+    index = InvertedIndex.build(['a', 'b', 'c', 'd'], recipes)
+    coverage = index.coverage(['chard'], align_to=['c', 'x', 'b'])
+    assert coverage.tolist() == [1, 0, 1]
+
+
+def test_save_and_load(tmp_path):
+    InvertedIndex.build(['a', 'b', 'c', 'd'],
+                        recipes).save(tmp_path / 'i.npz')
+    index = InvertedIndex.load(tmp_path / 'i.npz')
+    assert index.slots[index.postings('chard')].tolist() == [1, 2]
+    assert index.match('cherry tomato').tolist() == [0]
+
+
+def test_build_from_collection(tmp_path):
+    col = mongomock.MongoClient().RECIPES.BB
+    col.insert_many([{'_id': i, 'ingredients': ingredients}
+                     for i, ingredients in enumerate(recipes)])
+    recipe_index = RecipeIndex(tmp_path)
+    recipe_index.add([3, 1], ['flour', 'chard'], np.zeros((2, 2)))
+    index = build_ingredient_index(col, recipe_index)
+    assert index.coverage(['chard']).tolist() == [0, 1]
+    assert (tmp_path / INGREDIENTS_FILE).exists()
@@ -0,0 +1,159 @@
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mongomock
+import pytest
+
+from localvore import jobs
+from localvore.jobs import JobQueue
+
+
+@pytest.fixture(autouse=True)
+def mongo(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(jobs, 'MongoClient', lambda path: client)
+    jobs._jobs_collection.cache_clear()
+    yield client
+    jobs._jobs_collection.cache_clear()
+
+
+def counting(n, progress=None):
+    for i in range(n):
+        progress((i + 1) / n)
+        time.sleep(0.05)
+    return n
+
+
+def wait(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while queue.status(job_id)['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return queue.status(job_id)
+
+
+def test_process_pool_results_and_errors():
+    queue = JobQueue(workers=2)
+    try:
+        added = queue.submit(operator.add, 2, 3)
+        failed = queue.submit(operator.truediv, 1, 0)
+        assert wait(queue, added)['result'] == 5
+        job = wait(queue, failed)
+        assert job['status'] == 'failed'
+        assert 'ZeroDivisionError' in job['error']
+        assert queue.status('missing') is None
+    finally:
+        queue.shutdown()
+
+
+def test_identical_jobs_are_coalesced():
+    queue = JobQueue(workers=2, executor=ThreadPoolExecutor)
+    first = queue.submit(time.sleep, 0.2)
+    assert queue.submit(time.sleep, 0.2) == first
+    assert queue.submit(time.sleep, 0.1) != first
+    assert wait(queue, first)['status'] == 'done'
+    assert queue.submit(time.sleep, 0.2) != first
+    queue.shutdown()
+
+
+def test_finished_jobs_expire():
+    queue = JobQueue(keep=0, executor=ThreadPoolExecutor)
+    job_id = queue.submit(operator.neg, 1)
+    assert wait(queue, job_id)['result'] == -1
+    queue.submit(operator.neg, 2)
+    assert queue.status(job_id) is None
+    queue.shutdown()
+
+
+def test_jobs_are_shared_between_workers():
+    first = JobQueue(executor=ThreadPoolExecutor)
+    second = JobQueue(executor=ThreadPoolExecutor)
+    job_id = first.submit(time.sleep, 0.2)
+    assert second.submit(time.sleep, 0.2) == job_id
+    assert second.status(job_id)['status'] in ('queued', 'running')
+    assert wait(second, job_id)['status'] == 'done'
+    assert second.submit(time.sleep, 0.2) != job_id
+    first.shutdown()
+    second.shutdown()
+
+
+def test_progress_is_stored():
+    queue = JobQueue(executor=ThreadPoolExecutor)
+    job_id = queue.submit(counting, 4)
+    seen = set()
+    while queue.status(job_id)['status'] != 'done':
+        seen.add(queue.status(job_id)['progress'])
+        time.sleep(0.01)
+    assert seen & {0.25, 0.5, 0.75}
+    assert queue.status(job_id)['progress'] == 1.0
+    queue.shutdown()
+
+
+def test_jobs_of_a_dead_worker_fail(mongo):
+    queue = JobQueue(executor=ThreadPoolExecutor, heartbeat=0.05, stale=0.2)
+    job_id = queue.submit(time.sleep, 0.5)
+    # A worker that died mid job: the record stays running, never beating
+    mongo.RECIPES.jobs.insert_one(
+        {'_id': 'orphan', 'status': 'running', 'owner': 'gone:1',
+         'submitted': 0, 'heartbeat': 0, 'started': 0, 'finished': None,
+         'progress': 0.5})
+    mongo.RECIPES['jobs.in_flight'].insert_one(
+        {'_id': JobQueue._key(time.sleep, (0.4,), dict()), 'job': 'orphan',
+         'submitted': 0})
+    job = queue.status('orphan')
+    assert job['status'] == 'failed' and 'gone:1' in job['error']
+    assert queue.submit(time.sleep, 0.4) != 'orphan'
+    # Live jobs keep beating past stale
+    assert wait(queue, job_id)['status'] == 'done'
+    queue.shutdown()
+
+
+def test_finished_claims_are_released(mongo):
+    queue = JobQueue(executor=ThreadPoolExecutor)
+    mongo.RECIPES.jobs.insert_one(
+        {'_id': 'old', 'status': 'done', 'finished': time.time()})
+    mongo.RECIPES['jobs.in_flight'].insert_one(
+        {'_id': JobQueue._key(operator.neg, (1,), dict()), 'job': 'old',
+         'submitted': 0})
+    job_id = queue.submit(operator.neg, 1)
+    assert job_id != 'old'
+    assert wait(queue, job_id)['result'] == -1
+    queue.shutdown()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from localvore import app as app_module
+    monkeypatch.setattr(app_module, 'jobs',
+                        JobQueue(executor=ThreadPoolExecutor))
+    monkeypatch.setattr(app_module, 'run_clustering',
+                        lambda algorithm, state, collections, **params:
+                        [algorithm, state, collections, params])
+    return app_module.app.test_client()
+
+
+def test_cluster_endpoints(client):
+    assert client.post('/api/cluster', json={}).status_code == 400
+    response = client.post('/api/cluster', json={
+        'algorithm': 'clusters', 'state': 'iowa',
+        'params': {'n_clusters': 3}})
+    assert response.status_code == 202
+    job_url = response.get_json()['status']
+    deadline = time.monotonic() + 5
+    while client.get(job_url).get_json()['status'] != 'done':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert client.get(job_url).get_json()['result'] == \
+        ['clusters', 'iowa', ['BB'], {'n_clusters': 3}]
+    assert client.get('/api/jobs/missing').status_code == 404
+
+
+def test_cluster_params_are_checked(client):
+    response = client.post('/api/cluster', json={
+        'algorithm': 'clusters', 'state': 'iowa',
+        'params': {'n_recipes': 3}})
+    assert response.status_code == 400
+    assert 'n_recipes' in response.get_json()['error']
+    assert client.post('/api/cluster', json={
+        'state': 'iowa', 'params': ['seed']}).status_code == 400
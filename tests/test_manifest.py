@@ -0,0 +1,54 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from localvore.crawler import Crawler
+from localvore.manifest import CrawlManifest
+
+
+def test_record_and_conditional_headers(tmp_path):
+    manifest = CrawlManifest(tmp_path / 'm.sqlite')
+    url = 'https://example.com/a'
+    assert manifest.conditional_headers(url) == {}
+    assert manifest.record(url, 200, {'ETag': '"1"'}, b'body')
+    # Not parsed yet, so it is fetched unconditionally and still needs parsing
+    assert manifest.conditional_headers(url) == {}
+    assert manifest.record(url, 200, {'ETag': '"1"'}, b'body')
+    manifest.set_parse_status(url, 'ok')
+    assert manifest.conditional_headers(url) == {'If-None-Match': '"1"'}
+    assert not manifest.record(url, 200, {'ETag': '"1"'}, b'body')
+    assert manifest.record(url, 200, {'ETag': '"2"'}, b'new body')
+    assert len(CrawlManifest(tmp_path / 'm.sqlite')) == 1
+
+
+@pytest.mark.asyncio
+async def test_recrawl_only_parses_changed_pages(tmp_path):
+    bodies = {'a': 'A', 'b': 'B', 'c': 'C'}
+
+    async def page(request):
+        name = request.match_info['name']
+        etag = f'"{bodies[name]}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        # c ignores conditional requests but keeps its content
+        headers = {} if name == 'c' else {'ETag': etag}
+        return web.Response(text=bodies[name], headers=headers)
+
+    app = web.Application()
+    app.router.add_get('/{name}', page)
+    manifest = CrawlManifest(tmp_path / 'm.sqlite')
+    async with TestServer(app) as server:
+        urls = [str(server.make_url(f'/{name}')) for name in bodies]
+
+        async def crawl():
+            parsed = []
+            async with Crawler(rate=1000, manifest=manifest) as crawler:
+                await crawler.crawl(
+                    urls, lambda url, body: ([], body.decode()), parsed.append)
+            return sorted(parsed), crawler.stats
+
+        assert (await crawl())[0] == ['A', 'B', 'C']
+        bodies['b'] = 'B2'
+        parsed, stats = await crawl()
+    assert parsed == ['B2']
+    assert stats['unchanged'] == 2
@@ -0,0 +1,44 @@
+import mongomock
+import pytest
+
+from localvore import menus
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(menus, 'MongoClient', mongomock.MongoClient)
+    monkeypatch.setattr(menus, 'recipe_counts',
+                        lambda collections: {c: 10 for c in collections})
+    return menus.MenuStore()
+
+
+def test_materialize_and_rotate(store):
+    calls = []
+
+    def make_menu(state, collections, n_recipes):
+        calls.append(state)
+        return [f'{state} recipe {len(calls) % 3}'] * n_recipes
+
+    stored = menus.materialize(store, ['oregon', 'iowa'], ['BB'], n_menus=3,
+                               n_recipes=2, make_menu=make_menu)
+    assert stored == 2
+    served = [menus.serve_menu(store, 'oregon', ['BB']) for _ in range(4)]
+    assert len({tuple(menu) for menu in served[:3]}) == 3
+    assert served[3] == served[0]
+    assert store.collection.count_documents({}) == 2
+
+
+def test_duplicates_are_retried_but_bounded(store):
+    stored = menus.materialize(store, ['iowa'], ['BB'], n_menus=5,
+                               make_menu=lambda *args: ['kale soup'])
+    assert stored == 1
+    assert store.get('iowa', ['BB'])['menus'] == [['kale soup']]
+
+
+def test_stale_menus_are_not_served(store):
+    menus.materialize(store, ['iowa'], ['BB'], n_menus=1,
+                      period='early-june', make_menu=lambda *args: ['soup'])
+    assert store.next_menu('iowa', ['BB'], {'BB': 10},
+                           'early-june') == ['soup']
+    assert store.next_menu('iowa', ['BB'], {'BB': 11}, 'early-june') is None
+    assert store.next_menu('iowa', ['BB'], {'BB': 10}, 'late-june') is None
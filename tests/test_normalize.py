@@ -0,0 +1,51 @@
+import mongomock
+import numpy as np
+import pandas as pd
+from hypothesis import given, strategies as st
+
+from localvore import models
+from localvore.normalize import (normalize_ingredient, normalize_ingredients,
+                                 normalize_recipes, strip_details)
+
+
+def test_normalize_ingredient():
+    assert normalize_ingredient('onion (1/2 cup), diced') == 'onion '
+    assert normalize_ingredient('salt, to taste, divided') == 'salt'
+    assert normalize_ingredient(', chopped parsley') == ' chopped parsley'
+    assert normalize_ingredient('rice ((brown) or white)') == 'rice '
+    assert normalize_ingredient(',,') == ''
+    assert normalize_ingredient('') == ''
+
+
+@given(st.lists(st.text()))
+def test_batch_matches_single(raw):
+    assert strip_details(raw) == [normalize_ingredient(item) for item in raw]
+    assert [normalize_ingredient(item) for item in strip_details(raw)] == \
+        strip_details(raw)
+
+
+def test_series_keeps_index():
+    series = pd.Series(['kale, torn', 'kale, torn', 'beet (red)'],
+                       index=[5, 6, 7], name='raw')
+    normalized = normalize_ingredients(series)
+    assert normalized.index.tolist() == [5, 6, 7]
+    assert normalized.tolist() == ['kale', 'kale', 'beet ']
+    assert normalize_ingredients(np.array([], dtype=object)).tolist() == []
+
+
+def test_normalize_recipes():
+    recipes = [['a, b', 'c (d)'], [], ['e']]
+    assert normalize_recipes(recipes) == [['a', 'c '], [], ['e']]
+    assert normalize_recipes([]) == []
+
+
+def test_trim_ingredients(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(models, 'MongoClient', lambda path: client)
+    col = client.RECIPES.BB
+    col.insert_many([{'_id': 1, 'ingredients': [', salt', 'kale (1 bunch)']},
+                     {'_id': 2, 'ingredients': ['rice']},
+                     {'_id': 3, 'title': 'no ingredients'}])
+    assert models.trim_ingredients(batch_size=1) == 1
+    assert col.find_one({'_id': 1})['ingredients'] == [' salt', 'kale ']
+    assert col.find_one({'_id': 2})['ingredients'] == ['rice']
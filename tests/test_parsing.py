@@ -0,0 +1,53 @@
+import pickle
+from pathlib import Path
+
+import pytest
+
+from localvore.parsing import RecipeExtractor
+
+corpus = Path(__file__).parents[1].resolve() / 'ella'
+tags = {
+    'root_url': 'https://naturallyella.com',
+    'pagination': 46,
+    'nav_title': 'h2.entry-title',
+    'title': 'h1.entry-title',
+    'category': 'span.tasty-recipes-category',
+    'full_recipe': 'div.tasty-recipes-entry-content',
+    'ingredients': 'div.tasty-recipes-ingredients',
+    'instructions': 'div.tasty-recipes-instructions',
+    'notes':  'div.tasty-recipes-notes',
+    'keywords': 'em'
+}
+
+
+@pytest.mark.parametrize('backend', ['lxml', 'bs4'])
+def test_extract_saved_recipe(backend):
+    html = (corpus / 'arugula-lentil-salad.html').read_bytes()
+    post = RecipeExtractor(tags, backend)(html)
+    assert post['title'] == 'Arugula Lentil Salad'
+    assert post['ingredients'][0] == '1/2 cup Puy Lentils'
+    assert len(post['ingredients']) == 15
+    assert post['instructions'][0].startswith('In a pot')
+    assert 'tasty-recipes-entry-content' in post['full_recipe']
+
+
+def test_backends_agree():
+    html = (corpus / 'arugula-lentil-salad.html').read_bytes()
+    lxml_post = RecipeExtractor(tags, 'lxml')(html)
+    bs4_post = RecipeExtractor(tags, 'bs4')(html)
+    del lxml_post['full_recipe'], bs4_post['full_recipe']
+    assert lxml_post == bs4_post
+
+
+def test_missing_recipe_returns_none():
+    page = b'<html><body><p>hi</p></body></html>'
+    assert RecipeExtractor(tags)(page) is None
+
+
+def test_extractor_pickles_without_compiled_selectors():
+    page = b'<div class="tasty-recipes-entry-content"></div>'
+    extractor = RecipeExtractor(tags)
+    extractor(page)
+    clone = pickle.loads(pickle.dumps(extractor))
+    assert clone._selectors is None
+    assert clone(page) is not None
@@ -0,0 +1,63 @@
+import numpy as np
+
+from localvore.recipe_clusters import (CLUSTERS_DIR, RecipeClusters,
+                                       update_clusters)
+from localvore.recipe_index import RecipeIndex
+
+
+def blobs(n, dim=16, centers=4, seed=0):
+    rng = np.random.RandomState(seed)
+    means = rng.rand(centers, dim) * 10
+    truth = np.arange(n) % centers
+    X = means[truth] + rng.normal(scale=0.1, size=(n, dim))
+    return X.astype(np.float32), truth
+
+
+def make_index(path, X):
+    index = RecipeIndex(path)
+    index.add([f'id{i}' for i in range(len(X))],
+              [f'title{i}' for i in range(len(X))], X)
+    return index
+
+
+def same_partition(labels, truth):
+    pairs = set(zip(labels.tolist(), truth.tolist()))
+    return len(pairs) == len(set(truth.tolist())) == len(set(labels.tolist()))
+
+
+def test_fit_recovers_blobs_from_a_sample(tmp_path):
+    X, truth = blobs(400)
+    index = make_index(tmp_path, X)
+    clusters = RecipeClusters.fit(index, n_clusters=4, n_components=4,
+                                  sample=100)
+    assert clusters.labels.dtype == np.int32
+    assert same_partition(clusters.labels, truth)
+    assert clusters.components.shape == (4, 16)
+
+
+def test_update_labels_new_rows_without_refitting(tmp_path):
+    X, truth = blobs(200)
+    index = make_index(tmp_path, X[:120])
+    clusters = update_clusters(index, n_clusters=4, n_components=4)
+    centroids = clusters.centroids.copy()
+    index.add([f'id{i}' for i in range(120, 200)],
+              [f'title{i}' for i in range(120, 200)], X[120:])
+    clusters = update_clusters(index)
+    assert len(clusters) == 200
+    assert np.array_equal(clusters.centroids, centroids)
+    assert same_partition(clusters.labels, truth)
+
+    saved = RecipeClusters(tmp_path / CLUSTERS_DIR)
+    assert np.array_equal(saved.labels, clusters.labels)
+    assert saved.n_clusters == 4
+
+
+def test_distances_to_own_centroid(tmp_path):
+    X, _ = blobs(100)
+    index = make_index(tmp_path, X)
+    clusters = update_clusters(index, n_clusters=4, n_components=4)
+    rows = np.arange(10)
+    distances = clusters.distances(rows, X[rows])
+    reduced = clusters.transform(X[rows])
+    all_distances = ((reduced[:, None] - clusters.centroids) ** 2).sum(-1)
+    assert np.allclose(distances, all_distances.min(axis=1), atol=1e-3)
@@ -0,0 +1,43 @@
+import mongomock
+import numpy as np
+
+from localvore.recipe_index import RecipeIndex, update_index
+from localvore.vector_format import encode_vector
+
+
+def make_index(path, n=50, dim=8):
+    X = np.random.RandomState(0).rand(n, dim).astype(np.float32)
+    index = RecipeIndex(path)
+    index.add([f'id{i}' for i in range(n // 2)],
+              [f'title{i}' for i in range(n // 2)], X[:n // 2])
+    index.add([f'id{i}' for i in range(n // 2, n)],
+              [f'title{i}' for i in range(n // 2, n)], X[n // 2:])
+    return index, X
+
+
+def test_index_reloads_appended_rows(tmp_path):
+    index, X = make_index(tmp_path)
+    loaded = RecipeIndex(tmp_path)
+    assert len(loaded) == 50
+    np.testing.assert_array_equal(loaded.vectors, X)
+
+
+def test_mask_selects_ids(tmp_path):
+    index, _ = make_index(tmp_path)
+    mask = index.mask(['id1', 'id7', 'id30'])
+    assert sorted(index.ids[mask]) == ['id1', 'id30', 'id7']
+
+
+def test_update_index_is_incremental(tmp_path):
+    col = mongomock.MongoClient().RECIPES.BB
+    col.insert_many([{'_id': i, 'title': f'r{i}',
+                      'vector': encode_vector(np.full(4, i))}
+                     for i in range(3)])
+    col.insert_one({'_id': 99, 'title': 'no vector'})
+    assert len(update_index(col, tmp_path)) == 3
+    col.insert_one({'_id': 3, 'title': 'r3',
+                    'vector': encode_vector(np.ones(4))})
+    index = update_index(col, tmp_path)
+    assert len(index) == 4
+    assert index.titles[-1] == 'r3'
+    np.testing.assert_array_equal(index.vectors[2], np.full(4, 2))
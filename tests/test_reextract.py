@@ -0,0 +1,24 @@
+import shutil
+from pathlib import Path
+
+import mongomock
+
+from localvore.parsing import ella_tags
+from localvore.reextract import reextract
+
+corpus = Path(__file__).parents[1].resolve() / 'ella'
+
+
+def test_reextract_corpus(tmp_path):
+    for name in ['arugula-lentil-salad.html', 'asparagus-and-eggs.html']:
+        shutil.copy(corpus / name, tmp_path / name)
+    (tmp_path / 'not-a-recipe.html').write_text('<p>nothing here</p>')
+    col = mongomock.MongoClient().RECIPES.ella
+    assert reextract(tmp_path, col, ella_tags, workers=1) == 2
+    recipe = col.find_one({'_id': 'arugula-lentil-salad'})
+    assert recipe['title'] == 'Arugula Lentil Salad'
+    assert recipe['raw_ingredients'][0] == '1/2 cup Puy Lentils'
+    assert len(recipe['ingredients']) == len(recipe['raw_ingredients'])
+    # Replaying the corpus replaces documents rather than duplicating them
+    reextract(tmp_path, col, ella_tags, workers=1)
+    assert col.count_documents({}) == 2
@@ -0,0 +1,53 @@
+from datetime import date
+
+import mongomock
+import pytest
+
+from localvore import seasonal
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(seasonal, 'MongoClient', mongomock.MongoClient)
+    return seasonal.SeasonalStore()
+
+
+def test_get_date():
+    assert seasonal.get_date(date(2020, 5, 3)) == 'early-may'
+    assert seasonal.get_date(date(2020, 1, 31)) == 'late-january'
+
+
+def test_refresh_and_get(store):
+    scraped = []
+
+    def scrape(state, period):
+        scraped.append(state)
+        return [f'{state} kale']
+    assert store.refresh(['ohio', 'utah'], 'early-may', scrape) == 2
+    assert store.get('ohio', 'early-may') == ['ohio kale']
+    store.get('ohio', 'early-may')
+    assert scraped == ['ohio', 'utah']
+
+
+def test_falls_back_to_last_period(store):
+    store.refresh(['ohio'], 'early-may', lambda state, period: ['ramps'])
+
+    def broken(state, period):
+        raise ConnectionError('site down')
+    assert store.refresh(['ohio'], 'late-may', broken) == 0
+    assert store.get('ohio', 'late-may') == ['ramps']
+
+
+def test_fallback_picks_up_refresh_by_another_store(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(seasonal, 'MongoClient', lambda path: client)
+    cron, worker = seasonal.SeasonalStore(), seasonal.SeasonalStore()
+    cron.put('ohio', 'early-may', ['ramps'])
+    assert worker.get('ohio', 'late-may') == ['ramps']
+    cron.put('ohio', 'late-may', ['asparagus'])
+    assert worker.get('ohio', 'late-may') == ['asparagus']
+
+
+def test_unknown_state_never_scrapes(store):
+    with pytest.raises(KeyError):
+        store.get('ohio')
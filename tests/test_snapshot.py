@@ -0,0 +1,63 @@
+import mongomock
+import numpy as np
+import pytest
+
+from localvore.snapshot import Snapshot, export_snapshot
+from localvore.vector_format import encode_vector
+
+pytest.importorskip('pyarrow')
+
+N = 25
+
+
+@pytest.fixture
+def collection():
+    col = mongomock.MongoClient().RECIPES.recipes
+    rng = np.random.RandomState(0)
+    col.insert_many([{'_id': f'{i:03d}', 'title': f'Recipe {i}',
+                      'url': f'http://x/{i}', 'ingredients': ['kale', 'leek'],
+                      'vector': encode_vector(rng.rand(6).astype(np.float32))}
+                     for i in range(N)])
+    col.insert_one({'_id': 'novector', 'title': 'Raw'})
+    return col
+
+
+def test_export_round_trip(collection, tmp_path):
+    path = export_snapshot(collection, tmp_path / 'recipes', batch_size=4)
+    assert not (tmp_path / 'recipes.partial').exists()
+    snapshot = Snapshot(path)
+    assert len(snapshot) == N and snapshot.dim == 6
+    assert isinstance(snapshot.vectors, np.memmap)
+    assert not snapshot.vectors.flags.writeable
+    assert snapshot.metadata.column('_id').to_pylist()[:2] == ['000', '001']
+    df = snapshot.to_pandas()
+    assert list(df['ingredients'][3]) == ['kale', 'leek']
+    assert np.shares_memory(df['vector'][3], snapshot.vectors)
+    index = snapshot.to_index()
+    expected = collection.find_one({'_id': '003'})
+    assert index.titles[3] == expected['title']
+    assert np.shares_memory(index.vectors, snapshot.vectors)
+
+
+def test_export_replaces_previous_snapshot(collection, tmp_path):
+    path = export_snapshot(collection, tmp_path / 'recipes')
+    collection.delete_many({'_id': {'$gte': '010'}})
+    export_snapshot(collection, path)
+    assert len(Snapshot(path)) == 10
+
+
+def test_export_without_vectors_fails(tmp_path):
+    with pytest.raises(ValueError, match='no vectors'):
+        export_snapshot(mongomock.MongoClient().RECIPES.empty, tmp_path / 'x')
+
+
+def test_collection_matrix_loads_snapshot(collection, tmp_path, monkeypatch):
+    from localvore import clustering
+    export_snapshot(collection, tmp_path / 'snapshots' / 'recipes')
+    monkeypatch.setattr(clustering, 'INDEX_PATH', tmp_path / 'index')
+    monkeypatch.setattr(clustering, 'SNAPSHOT_PATH', tmp_path / 'snapshots')
+    monkeypatch.setattr(clustering, 'MongoClient', None)
+    clustering.matrices.invalidate(lambda key: key == 'recipes')
+    index = clustering.collection_matrix('recipes')
+    clustering.matrices.invalidate(lambda key: key == 'recipes')
+    assert len(index) == N and index.ids[0] == '000'
@@ -0,0 +1,29 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+LOCALVORE = Path(__file__).resolve().parents[1] / 'localvore'
+HEAVY = ['sklearn', 'spacy', 'pandas', 'requests_html', 'pyppeteer',
+         'scraper', 'clustering']
+
+
+def loaded_after_import(module):
+    code = (f'import json, sys; sys.path.insert(0, {str(LOCALVORE)!r}); '
+            f'import {module}; '
+            f'print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))')
+    out = subprocess.run([sys.executable, '-c', code], check=True,
+                         stdout=subprocess.PIPE, timeout=60).stdout
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def test_app_import_stays_light():
+    assert loaded_after_import('app') == []
+
+
+@pytest.mark.parametrize('module', ['scraper', 'clustering'])
+def test_import_has_no_side_effects(module):
+    # Importing scraper used to start a full crawl of naturallyella.com
+    assert loaded_after_import(module) == [module]
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from localvore import tracing
+
+
+@pytest.fixture
+def traced():
+    tracing.reset()
+    tracing.enable()
+    yield
+    tracing.enable(False)
+    tracing.reset()
+
+
+def test_spans_fill_histograms(traced):
+    @tracing.span('decorated')
+    def work(x):
+        time.sleep(0.002)
+        return x * 2
+
+    assert work(2) == 4
+    assert work.__name__ == 'work'
+    with tracing.span('block'):
+        pass
+    text = tracing.render()
+    assert '# TYPE localvore_stage_seconds histogram' in text
+    assert 'localvore_stage_seconds_count{stage="decorated"} 1' in text
+    assert 'localvore_stage_seconds_bucket{stage="decorated",le="0.001"} 0' \
+        in text
+    assert 'localvore_stage_seconds_bucket{stage="block",le="+Inf"} 1' in text
+
+
+def test_request_breakdown(traced):
+    tracing.start_request()
+    with tracing.span('outer'):
+        with tracing.span('inner'):
+            pass
+    stages = tracing.finish_request()
+    assert [stage for stage, _ in stages] == ['inner', 'outer']
+    assert tracing.server_timing(stages).startswith('inner;dur=')
+    assert tracing.finish_request() is None
+
+
+def test_disabled_spans_record_nothing():
+    tracing.reset()
+    work = tracing.span('off')(lambda: None)
+    start = time.perf_counter()
+    for _ in range(100000):
+        work()
+        with tracing.span('off'):
+            pass
+    assert time.perf_counter() - start < 1
+    assert 'stage="off"' not in tracing.render()
+
+
+def test_metrics_route_and_debug_header(monkeypatch):
+    from localvore import app as app_module
+    # app imports its siblings top-level, so it has its own tracing module
+    app_tracing = app_module.tracing
+    app_tracing.reset()
+    monkeypatch.setattr(app_tracing, '_enabled', True)
+
+    def serve_menu(store, state, collections):
+        with app_tracing.span('menu_lookup'):
+            return ['kale soup']
+    monkeypatch.setattr(app_module, 'serve_menu', serve_menu)
+    client = app_module.app.test_client()
+    plain = client.get('/api/menu/iowa')
+    assert plain.get_json() == {'menu': ['kale soup']}
+    assert 'Server-Timing' not in plain.headers
+    debug = client.get('/api/menu/iowa',
+                       headers={app_module.DEBUG_HEADER: '1'})
+    assert debug.headers['Server-Timing'].startswith('menu_lookup;dur=')
+    assert 'get_menu;dur=' in debug.headers['Server-Timing']
+    metrics = client.get('/metrics')
+    assert metrics.content_type.startswith('text/plain')
+    assert 'localvore_stage_seconds_count{stage="get_menu"} 2' in \
+        metrics.get_data(as_text=True)
+    app_tracing.reset()
@@ -0,0 +1,28 @@
+import pickle
+
+import numpy as np
+from bson.binary import Binary
+
+from localvore import vector_format
+
+
+def test_roundtrip():
+    vector = np.arange(300, dtype=np.float32)
+    blob = vector_format.encode_vector(vector)
+    assert len(blob) == vector_format.HEADER.size + 4 * 300
+    np.testing.assert_array_equal(vector_format.decode_vector(blob), vector)
+
+
+def test_decode_legacy_pickle():
+    vector = np.linspace(0, 1, 5, dtype=np.float32)
+    blob = Binary(pickle.dumps(vector))
+    assert not vector_format.is_encoded(blob)
+    np.testing.assert_array_equal(vector_format.decode_vector(blob), vector)
+
+
+def test_decode_vectors_batch():
+    matrix = np.random.rand(4, 6).astype(np.float32)
+    blobs = [vector_format.encode_vector(row) for row in matrix]
+    np.testing.assert_array_equal(vector_format.decode_vectors(blobs), matrix)
+    blobs[1] = Binary(pickle.dumps(matrix[1]))
+    np.testing.assert_array_equal(vector_format.decode_vectors(blobs), matrix)
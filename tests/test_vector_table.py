@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import spacy
+
+from localvore.vector_table import IngredientVectorTable
+
+
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank('en')
+    nlp.vocab.set_vector('salt', np.ones(3, dtype=np.float32))
+    nlp.vocab.set_vector('oil', np.full(3, 3, dtype=np.float32))
+    return nlp
+
+
+def test_recipe_vector_matches_spacy(tmp_path, nlp):
+    table = IngredientVectorTable(tmp_path, nlp=nlp)
+    vector = table.recipe_vector(['Salt', 'olive oil'])
+    np.testing.assert_allclose(vector, nlp('salt olive oil').vector)
+
+
+def test_recipe_vectors_batch(tmp_path, nlp):
+    table = IngredientVectorTable(tmp_path, nlp=nlp)
+    vectors = table.recipe_vectors([['salt'], [], ['oil', 'salt']])
+    assert vectors.shape == (3, 3)
+    np.testing.assert_allclose(vectors[0], np.ones(3))
+    np.testing.assert_allclose(vectors[1], np.zeros(3))
+    np.testing.assert_allclose(vectors[2], np.full(3, 2))
+
+
+def test_table_persists(tmp_path, nlp):
+    with IngredientVectorTable(tmp_path, nlp=nlp) as table:
+        table.add(['salt', 'olive oil'])
+    table = IngredientVectorTable(tmp_path, nlp=None)
+    assert len(table) == 2 and 'Olive Oil' in table
+    assert isinstance(table.vectors, np.memmap)
+    np.testing.assert_allclose(table.recipe_vector(['salt']), np.ones(3))
+
+
+def test_new_rows_are_written_once_per_flush(tmp_path, nlp):
+    table = IngredientVectorTable(tmp_path, nlp=nlp)
+    table.add(['salt'])
+    vectors = table.recipe_vectors([['salt', 'oil'], ['olive oil']])
+    assert not (tmp_path / 'vectors.npy').exists()
+    assert table.pending == 3
+    table.flush()
+    table.add(['pepper'])
+    np.testing.assert_allclose(table.recipe_vectors([['salt', 'oil'],
+                                                     ['olive oil']]),
+                               vectors)
+    table.flush()
+    assert len(IngredientVectorTable(tmp_path)) == 4
+
+
+def test_read_only_table_fails_on_misses(tmp_path, nlp):
+    with IngredientVectorTable(tmp_path, nlp=nlp) as table:
+        table.add(['salt'])
+    table = IngredientVectorTable(tmp_path, read_only=True)
+    np.testing.assert_allclose(table.recipe_vector(['salt']), np.ones(3))
+    with pytest.raises(KeyError, match='oil'):
+        table.recipe_vector(['oil'])